@@ -1,8 +1,16 @@
 
 import holcrawl.compound_cmd
 import holcrawl.dataset
+import holcrawl.engine
+import holcrawl.fetch
+import holcrawl.frontier
 import holcrawl.imdb_crawl
+import holcrawl.imdb_index
 import holcrawl.metacritic_crawl
+import holcrawl.page_cache
+import holcrawl.rate_limit
+import holcrawl.refresh
+import holcrawl.retry
 import holcrawl.shared
 import holcrawl.wiki_crawl
 
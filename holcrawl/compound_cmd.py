@@ -1,7 +1,23 @@
 """Holcrawl commans using more than one sub-component."""
 
 import os
+import collections
+
 import holcrawl
+from holcrawl import imdb_crawl
+from holcrawl import metacritic_crawl
+from holcrawl.fetch import (
+    bandwidth_stats,
+    print_bandwidth_stats
+)
+from holcrawl.shared import (
+    _journaled,
+    _file_job_name,
+    _years_job_name,
+    _titles_from_file,
+    _crawl_sources,
+    _result
+)
 
 
 def crawl_all_by_title(title, verbose):
@@ -10,44 +26,117 @@ def crawl_all_by_title(title, verbose):
     holcrawl.metacritic_crawl.crawl_by_title(title, verbose)
 
 
-def crawl_all_by_file(file_path, verbose):
-    """Crawls all sources and builds profiles for titles in the given file."""
-    holcrawl.imdb_crawl.crawl_by_file(file_path, verbose)
-    holcrawl.metacritic_crawl.crawl_by_file(file_path, verbose)
-
-
-def _crawl_by_year_helper(year, verbose, imdb, metacritic):
+# the crawler and display name of each source, in crawling order
+_SOURCES = collections.OrderedDict([
+    ('imdb', (imdb_crawl, 'IMDB')),
+    ('metacritic', (metacritic_crawl, 'Metacritic')),
+])
+
+
+def _crawl_pipelined(file_path, verbose, year=None, workers=1):
+    """Crawls all sources at once over the titles in the given file."""
+    crawlers = collections.OrderedDict(
+        (source, crawler.crawl_by_title_async)
+        for source, (crawler, _) in _SOURCES.items()
+        if crawler._subpages_for())
+    titles = _titles_from_file(file_path)
+    if verbose:
+        print("Crawling over all {} movies in {} from {}...".format(
+            len(titles), file_path, ', '.join(
+                _SOURCES[source][1] for source in crawlers)))
+    results = _crawl_sources(crawlers, titles, verbose, year, workers)
+    for source in crawlers:
+        print("{} {} movie profiles crawled.".format(
+            sum(results[source].values()), _SOURCES[source][1]))
+        for res_type in _result.ALL_TYPES:
+            print('{} {}.'.format(results[source][res_type], res_type))
+    if verbose and bandwidth_stats():
+        print_bandwidth_stats()
+
+
+def crawl_all_by_file(file_path, verbose, workers=1, pipelined=True):
+    """Crawls all sources and builds profiles for titles in the given file.
+
+    If pipelined, all sources are crawled at once, each with up to workers
+    titles crawled concurrently; otherwise sources are crawled one after the
+    other."""
+    with _journaled(_file_job_name('all_byfile', file_path)):
+        if pipelined:
+            _crawl_pipelined(file_path, verbose, workers=workers)
+        else:
+            holcrawl.imdb_crawl.crawl_by_file(
+                file_path, verbose, workers=workers)
+            holcrawl.metacritic_crawl.crawl_by_file(
+                file_path, verbose, workers=workers)
+
+
+def _crawl_by_year_helper(year, verbose, imdb, metacritic, workers=1,
+                          pipelined=False):
     filepath = holcrawl.shared._get_wiki_list_file_path(year)
     if not os.path.isfile(filepath):
         holcrawl.wiki_crawl.generate_title_file(year, verbose)
+    if imdb and metacritic and pipelined:
+        _crawl_pipelined(filepath, verbose, year, workers)
+        return
     if imdb:
-        holcrawl.imdb_crawl.crawl_by_file(filepath, verbose, year)
+        holcrawl.imdb_crawl.crawl_by_file(filepath, verbose, year, workers)
     if metacritic:
-        holcrawl.metacritic_crawl.crawl_by_file(filepath, verbose, year)
+        holcrawl.metacritic_crawl.crawl_by_file(
+            filepath, verbose, year, workers)
 
 
 def imdb_crawl_by_year(year, verbose):
     """Crawls IMDB and builds movie profiles for the given year."""
-    _crawl_by_year_helper(year, verbose, True, False)
+    with _journaled(_years_job_name('imdb_byyears', [year])):
+        _crawl_by_year_helper(year, verbose, True, False)
 
 #rerun from 2012 downwards
 def imdb_crawl_by_years(years, verbose):
     """Crawls IMDB and builds movie profiles for the given years."""
-    for year in years:
-        imdb_crawl_by_year(year, verbose)
+    with _journaled(_years_job_name('imdb_byyears', years)):
+        for year in years:
+            imdb_crawl_by_year(year, verbose)
 
 
 def metacritic_crawl_by_year(year, verbose):
     """Crawls Metacritic and builds movie profiles for the given year."""
-    _crawl_by_year_helper(year, verbose, False, True)
+    with _journaled(_years_job_name('metacritic_byyears', [year])):
+        _crawl_by_year_helper(year, verbose, False, True)
+
+
+def crawl_all_by_year(year, verbose, workers=1, pipelined=True):
+    """Crawls all sources and builds movie profiles for the given year,
+    crawling all sources at once if pipelined."""
+    with _journaled(_years_job_name('all_byyears', [year])):
+        _crawl_by_year_helper(year, verbose, True, True, workers, pipelined)
+
+
+def crawl_all_by_years(years, verbose, workers=1, pipelined=True):
+    """Crawls all sources and builds movie profiles for the given years,
+    crawling all sources at once if pipelined."""
+    with _journaled(_years_job_name('all_byyears', years)):
+        for year in years:
+            crawl_all_by_year(year, verbose, workers, pipelined)
+
 
+# === distributed crawling ===
 
-def crawl_all_by_year(year, verbose):
-    """Crawls all sources and builds movie profiles for the given year."""
-    _crawl_by_year_helper(year, verbose, True, True)
+def enqueue_by_file(file_path, verbose, year=None, sources=None,
+                    frontier_path=None):
+    """Adds tasks to crawl the titles in the given file from the given
+    sources (all sources by default) to the crawl frontier."""
+    titles = holcrawl.shared._titles_from_file(file_path)
+    added = holcrawl.frontier.enqueue_titles(
+        titles, year, sources, frontier_path)
+    if verbose:
+        print("{} tasks added to the frontier.".format(added))
 
 
-def crawl_all_by_years(years, verbose):
-    """Crawls all sources and builds movie profiles for the given years."""
+def enqueue_by_years(years, verbose, sources=None, frontier_path=None):
+    """Adds tasks to crawl all titles from the given years from the given
+    sources (all sources by default) to the crawl frontier."""
     for year in years:
-        crawl_all_by_year(year, verbose)
+        filepath = holcrawl.shared._get_wiki_list_file_path(year)
+        if not os.path.isfile(filepath):
+            holcrawl.wiki_crawl.generate_title_file(year, verbose)
+        enqueue_by_file(filepath, verbose, year, sources, frontier_path)
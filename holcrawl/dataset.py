@@ -9,6 +9,7 @@ import morejson as json
 
 import holcrawl.shared
 import holcrawl.imdb_crawl
+import holcrawl.metacritic_crawl
 
 
 _IMDB_DIR_PATH = holcrawl.shared._get_imdb_dir_path()
@@ -33,7 +34,8 @@ def _prof_names_in_all_resources():
 
 
 def build_united_profiles(verbose):
-    """Build movie profiles with data from all resources."""
+    """Build movie profiles with data from all resources. Movies with partial
+    profiles, missing some of their pages, are skipped."""
     os.makedirs(_UNITED_DIR_PATH, exist_ok=True)
     prof_names = sorted(_prof_names_in_all_resources())
     if verbose:
@@ -47,6 +49,11 @@ def build_united_profiles(verbose):
         meta_prof_path = os.path.join(_METACRITIC_DIR_PATH, file_name)
         with open(meta_prof_path, 'r') as meta_prof_file:
             meta_prof = json.load(meta_prof_file)
+        if holcrawl.shared._is_partial(
+                imdb_prof, holcrawl.imdb_crawl._MISSING_KEY) or \
+                holcrawl.shared._is_partial(
+                    meta_prof, holcrawl.metacritic_crawl._MISSING_KEY):
+            continue
         united_prof = {**imdb_prof, **meta_prof}
         united_prof_fpath = os.path.join(_UNITED_DIR_PATH, file_name)
         with open(united_prof_fpath, 'w+') as unite_prof_file:
@@ -0,0 +1,53 @@
+"""The asyncio event loop driving all of holcrawl's network I/O.
+
+All crawling coroutines run on a single event loop, living in a background
+daemon thread for the lifetime of the process, so that persistent
+connections and per-host state are shared between all callers. Synchronous
+code submits coroutines to it with run_sync."""
+
+import asyncio
+import threading
+
+_LOOP = None
+_LOOP_THREAD = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop():
+    """Returns the crawling event loop, starting it if needed."""
+    global _LOOP, _LOOP_THREAD  # pylint: disable=W0603
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            _LOOP_THREAD = threading.Thread(
+                target=_run_loop, args=(_LOOP,), name='holcrawl-engine',
+                daemon=True)
+            _LOOP_THREAD.start()
+        return _LOOP
+
+
+def in_engine_thread():
+    """Returns True if called from within the crawling event loop thread."""
+    return threading.current_thread() is _LOOP_THREAD
+
+
+def run_sync(coro):
+    """Runs the given coroutine on the crawling event loop, blocking until it
+    completes, and returns its result."""
+    if in_engine_thread():
+        coro.close()
+        raise RuntimeError(
+            "run_sync can't be called from within the crawling event loop; "
+            "await the coroutine instead.")
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    return future.result()
+
+
+def call_soon(callback, *args):
+    """Schedules a callback on the crawling event loop, thread-safely."""
+    get_loop().call_soon_threadsafe(callback, *args)
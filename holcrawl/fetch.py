@@ -0,0 +1,741 @@
+"""A pooled, keep-alive HTTP fetcher shared by all holcrawl crawlers.
+
+Requests are made with a small HTTP/1.1 client built on asyncio streams and
+running on the crawling event loop (see holcrawl.engine), so that thousands of
+requests can be in flight without an OS thread per request. Like urllib, it
+sends requests through the proxies set by the http_proxy and https_proxy
+environment variables, save for hosts listed in no_proxy."""
+
+import io
+import ssl
+import zlib
+import base64
+import asyncio
+import collections
+import http.client
+import urllib.request
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urljoin, unquote
+
+from bs4 import BeautifulSoup as bs
+
+from holcrawl._version import get_versions
+from holcrawl.engine import (
+    run_sync,
+    call_soon
+)
+from holcrawl.page_cache import get_page_cache
+from holcrawl.rate_limit import get_host_limiter
+from holcrawl.retry import with_retries
+from holcrawl.shared import (
+    _get_cfg,
+    _CfgKey,
+    set_replay_mode,
+    is_replay_mode
+)
+
+
+# === configuration ===
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0',
+    'Accept-Encoding': 'gzip, deflate',
+}
+DEFAULT_POOL_SIZE = 10
+
+def _get_headers():
+    headers = dict(DEFAULT_HEADERS)
+    headers.update(_get_cfg().get(_CfgKey.HTTP_HEADERS, {}))
+    return headers
+
+
+_POOL_SIZES = {}
+
+def set_pool_size(host, size):
+    """Sets the maximal number of persistent connections kept to a host."""
+    _POOL_SIZES[host] = size
+    for (_, netloc), pool in list(_POOLS.items()):
+        if netloc == host:
+            call_soon(pool.resize, size)
+
+
+def _get_pool_size(host):
+    if host in _POOL_SIZES:
+        return _POOL_SIZES[host]
+    cfg = _get_cfg()
+    try:
+        return cfg[_CfgKey.HOST_POOL_SIZES][host]
+    except KeyError:
+        return cfg.get(_CfgKey.POOL_SIZE, DEFAULT_POOL_SIZE)
+
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+_TIMEOUTS = {}
+
+def set_timeouts(connect_timeout=None, read_timeout=None):
+    """Sets the number of seconds to wait for a connection to be established
+    and for any data to be received on it before giving up."""
+    if connect_timeout is not None:
+        _TIMEOUTS[_CfgKey.CONNECT_TIMEOUT] = connect_timeout
+    if read_timeout is not None:
+        _TIMEOUTS[_CfgKey.READ_TIMEOUT] = read_timeout
+
+
+def get_timeouts():
+    """Returns the connect and read timeouts, in seconds."""
+    cfg = dict(_get_cfg())
+    cfg.update(_TIMEOUTS)
+    return (cfg.get(_CfgKey.CONNECT_TIMEOUT, DEFAULT_CONNECT_TIMEOUT),
+            cfg.get(_CfgKey.READ_TIMEOUT, DEFAULT_READ_TIMEOUT))
+
+
+# === connections ===
+
+class _Response(object):
+    """A fully-read HTTP response."""
+
+    def __init__(self, status, reason, headers, body, will_close):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.will_close = will_close
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+_Proxy = collections.namedtuple('_Proxy', ['host', 'port', 'auth'])
+
+def _get_proxy(scheme, host):
+    """Returns the proxy to send requests of the given scheme to the given
+    host through, as set by the environment, or None if there is none."""
+    proxy_url = urllib.request.getproxies().get(scheme)
+    if not proxy_url or urllib.request.proxy_bypass(host):
+        return None
+    if '://' not in proxy_url:
+        proxy_url = 'http://' + proxy_url
+    parts = urlsplit(proxy_url)
+    auth = None
+    if parts.username is not None:
+        credentials = '{}:{}'.format(
+            unquote(parts.username), unquote(parts.password or ''))
+        auth = 'Basic ' + base64.b64encode(
+            credentials.encode('utf-8')).decode('ascii')
+    return _Proxy(parts.hostname, parts.port or 80, auth)
+
+
+def _open_tunnel(proxy, host, port, timeout):
+    """Returns a blocking socket tunneled to the given host and port through
+    the given proxy with a CONNECT request."""
+    conn = http.client.HTTPConnection(proxy.host, proxy.port, timeout=timeout)
+    headers = {}
+    if proxy.auth is not None:
+        headers['Proxy-Authorization'] = proxy.auth
+    conn.set_tunnel(host, port, headers)
+    try:
+        conn.connect()
+    except BaseException:
+        conn.close()
+        raise
+    sock, conn.sock = conn.sock, None
+    return sock
+
+
+_SSL_CONTEXT = ssl.create_default_context()
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_NO_BODY_STATUSES = (204, 304)
+
+_READ_SIZE = 2 ** 16
+
+class _Connection(object):
+    """A persistent HTTP/1.1 connection to a single host.
+
+    Every read from the connection times out after read_timeout seconds with
+    no data received."""
+
+    def __init__(self, reader, writer, read_timeout):
+        self.reader = reader
+        self.writer = writer
+        self.read_timeout = read_timeout
+
+    @classmethod
+    async def open(cls, scheme, host, port, proxy=None):
+        """Opens a connection to the given host, through the given proxy if
+        any; HTTPS connections are tunneled through it."""
+        ssl_context = _SSL_CONTEXT if scheme == 'https' else None
+        connect_timeout, read_timeout = get_timeouts()
+        if proxy is None:
+            connecting = asyncio.open_connection(host, port, ssl=ssl_context)
+        elif ssl_context is None:
+            connecting = asyncio.open_connection(proxy.host, proxy.port)
+        else:
+            sock = await asyncio.wait_for(
+                asyncio.get_event_loop().run_in_executor(
+                    None, _open_tunnel, proxy, host, port, connect_timeout),
+                connect_timeout)
+            connecting = asyncio.open_connection(
+                sock=sock, ssl=ssl_context, server_hostname=host)
+        reader, writer = await asyncio.wait_for(connecting, connect_timeout)
+        return cls(reader, writer, read_timeout)
+
+    def is_stale(self):
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+    async def _readline(self):
+        return await asyncio.wait_for(
+            self.reader.readline(), self.read_timeout)
+
+    async def _readexactly(self, size):
+        chunks = []
+        while size > 0:
+            chunk = await asyncio.wait_for(
+                self.reader.readexactly(min(size, _READ_SIZE)),
+                self.read_timeout)
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    async def _read_to_eof(self):
+        chunks = []
+        while True:
+            chunk = await asyncio.wait_for(
+                self.reader.read(_READ_SIZE), self.read_timeout)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    async def _read_headers(self):
+        lines = []
+        while True:
+            line = await self._readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            lines.append(line)
+        return http.client.parse_headers(io.BytesIO(b''.join(lines) + b'\r\n'))
+
+    async def _read_chunked_body(self):
+        chunks = []
+        while True:
+            size_line = await self._readline()
+            size = int(size_line.split(b';')[0].strip(), 16)
+            if size == 0:
+                await self._read_headers()  # trailers
+                return b''.join(chunks)
+            chunks.append(await self._readexactly(size))
+            await self._readexactly(2)
+
+    async def _read_body(self, status, headers):
+        if status in _NO_BODY_STATUSES:
+            return b'', False
+        if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            return await self._read_chunked_body(), False
+        length = headers.get('Content-Length')
+        if length is not None:
+            return await self._readexactly(int(length)), False
+        return await self._read_to_eof(), True
+
+    async def request(self, netloc, target, headers):
+        """Sends a GET request for the given target, a path or, to a proxy,
+        an absolute URL, over this connection and reads the response."""
+        lines = ['GET {} HTTP/1.1'.format(target), 'Host: {}'.format(netloc)]
+        lines += ['{}: {}'.format(key, val) for key, val in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await asyncio.wait_for(self.writer.drain(), self.read_timeout)
+        while True:
+            status_line = await self._readline()
+            if not status_line:
+                raise http.client.RemoteDisconnected(
+                    "Remote end closed connection without response")
+            version, status, reason = (
+                status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+                + [''])[:3]
+            status = int(status)
+            resp_headers = await self._read_headers()
+            if status >= 200:
+                break
+        body, eof_delimited = await self._read_body(status, resp_headers)
+        conn_header = resp_headers.get('Connection', '').lower()
+        will_close = eof_delimited or conn_header == 'close' or (
+            version == 'HTTP/1.0' and conn_header != 'keep-alive')
+        return _Response(status, reason, resp_headers, body, will_close)
+
+
+# === connection pools ===
+
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    asyncio.IncompleteReadError,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+class _HostPool(object):
+    """A pool of persistent connections to a single host.
+
+    At most size requests are in flight to the host at any given time; idle
+    connections are kept open and reused by later requests. Pools are only
+    ever used from within the crawling event loop."""
+
+    def __init__(self, scheme, netloc, size):
+        self.scheme = scheme
+        self.netloc = netloc
+        parts = urlsplit('//' + netloc)
+        self.host = parts.hostname
+        self.port = parts.port or _DEFAULT_PORTS[scheme]
+        self.proxy = _get_proxy(scheme, self.host)
+        self.size = size
+        self._idle = []
+        self._in_use = 0
+        self._waiters = collections.deque()
+
+    def _wake_next(self):
+        while self._waiters and self._in_use < self.size:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def resize(self, size):
+        self.size = size
+        for _ in range(max(0, size - self._in_use)):
+            self._wake_next()
+
+    async def _acquire(self):
+        while self._in_use >= self.size:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next()
+                raise
+        self._in_use += 1
+
+    def _release(self, conn):
+        self._in_use -= 1
+        if conn is not None:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+            else:
+                conn.close()
+        self._wake_next()
+
+    async def _checkout(self):
+        await self._acquire()
+        while self._idle:
+            conn = self._idle.pop()
+            if not conn.is_stale():
+                return conn, True
+            conn.close()
+        try:
+            return await self._open(), False
+        except BaseException:
+            self._release(None)
+            raise
+
+    def _open(self):
+        return _Connection.open(self.scheme, self.host, self.port, self.proxy)
+
+    async def request(self, path, headers):
+        """Sends a GET request for the given path, returning the fully-read
+        response."""
+        target = path
+        if self.proxy is not None and self.scheme == 'http':
+            # plain HTTP requests are forwarded by the proxy itself
+            target = 'http://{}{}'.format(self.netloc, path)
+            if self.proxy.auth is not None:
+                headers = dict(headers)
+                headers['Proxy-Authorization'] = self.proxy.auth
+        conn, reused = await self._checkout()
+        try:
+            try:
+                response = await conn.request(self.netloc, target, headers)
+            except _STALE_CONNECTION_ERRORS:
+                # the server closed an idle keep-alive connection on us
+                conn.close()
+                if not reused:
+                    raise
+                conn = await self._open()
+                response = await conn.request(self.netloc, target, headers)
+        except BaseException:
+            conn.close()
+            self._release(None)
+            raise
+        if response.will_close:
+            conn.close()
+            conn = None
+        self._release(conn)
+        return response
+
+    def close(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+
+
+_POOLS = {}
+
+def _get_pool(scheme, netloc):
+    key = (scheme, netloc)
+    if key not in _POOLS:
+        _POOLS[key] = _HostPool(scheme, netloc, _get_pool_size(netloc))
+    return _POOLS[key]
+
+
+async def _close_pools():
+    for pool in _POOLS.values():
+        pool.close()
+
+
+def close_pools():
+    """Closes all idle persistent connections."""
+    run_sync(_close_pools())
+
+
+# === compression and bandwidth accounting ===
+
+def _decode_body(body, content_encoding):
+    # bodiless responses, like empty redirects, may still name an encoding
+    if not body:
+        return body
+    content_encoding = (content_encoding or '').strip().lower()
+    if content_encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if content_encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # some servers send raw deflate streams, with no zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+_BANDWIDTH_FIELDS = ['requests', 'transferred', 'decompressed']
+_BANDWIDTH = {}
+
+def _record_bandwidth(host, page_type, transferred, decompressed):
+    stats = _BANDWIDTH.setdefault(
+        (host, page_type), {field: 0 for field in _BANDWIDTH_FIELDS})
+    stats['requests'] += 1
+    stats['transferred'] += transferred
+    stats['decompressed'] += decompressed
+
+
+def bandwidth_stats():
+    """Returns a dict mapping (host, page type) tuples to the number of
+    requests made, response bytes transferred and response bytes after
+    decompression."""
+    return {key: dict(stats) for key, stats in _BANDWIDTH.items()}
+
+
+def reset_bandwidth_stats():
+    """Resets all bandwidth accounting."""
+    _BANDWIDTH.clear()
+
+
+def print_bandwidth_stats():
+    """Prints bandwidth accounting by host and page type to screen."""
+    print("{:<24} {:<12} {:>9} {:>14} {:>14}".format(
+        'host', 'page type', 'requests', 'transferred', 'decompressed'))
+    for (host, page_type), stats in sorted(
+            _BANDWIDTH.items(), key=lambda item: str(item[0])):
+        print("{:<24} {:<12} {:>9} {:>14} {:>14}".format(
+            host, str(page_type), stats['requests'], stats['transferred'],
+            stats['decompressed']))
+
+
+# === hedging ===
+
+DEFAULT_HEDGE_PERCENTILE = 95
+_LATENCY_WINDOW = 200
+_MIN_LATENCY_SAMPLES = 20
+_HEDGING = {}
+
+def set_hedging(enabled, percentile=None):
+    """Turns hedged requests on or off. When on, a duplicate of a request
+    is sent if it is not answered within the given percentile of recent
+    latencies for its host and page type, and the first answer is used."""
+    _HEDGING[_CfgKey.HEDGING] = bool(enabled)
+    if percentile is not None:
+        _HEDGING[_CfgKey.HEDGE_PERCENTILE] = percentile
+
+
+def _get_hedging():
+    cfg = dict(_get_cfg())
+    cfg.update(_HEDGING)
+    return (cfg.get(_CfgKey.HEDGING, False),
+            cfg.get(_CfgKey.HEDGE_PERCENTILE, DEFAULT_HEDGE_PERCENTILE))
+
+
+_LATENCIES = {}
+
+def _record_latency(host, page_type, latency):
+    _LATENCIES.setdefault(
+        (host, page_type),
+        collections.deque(maxlen=_LATENCY_WINDOW)).append(latency)
+
+
+def _hedge_delay(host, page_type, percentile):
+    """Returns the given percentile of recent latencies for the given host
+    and page type, or None if too few were recorded."""
+    latencies = _LATENCIES.get((host, page_type), ())
+    if len(latencies) < _MIN_LATENCY_SAMPLES:
+        return None
+    latencies = sorted(latencies)
+    return latencies[int(round(percentile / 100 * (len(latencies) - 1)))]
+
+
+_HEDGE_FIELDS = ['sent', 'won']
+_HEDGES = {}
+
+def _count_hedge(host, field):
+    _HEDGES.setdefault(host, {key: 0 for key in _HEDGE_FIELDS})[field] += 1
+
+
+def hedge_stats():
+    """Returns a dict mapping hosts to the number of hedge requests sent to
+    them, and the number of those answered before the original request."""
+    return {host: dict(stats) for host, stats in _HEDGES.items()}
+
+
+# === replay mode ===
+
+# replay mode is switched with set_replay_mode, imported from shared along
+# with is_replay_mode
+
+class PageNotCachedError(LookupError):
+    """Raised in replay mode when a requested page is not in the page
+    cache."""
+
+
+# === fetching ===
+
+class _Page(object):
+    """A fetched page, along with the hash of its contents in the page cache
+    and whether it was found unchanged since its latest cached fetch."""
+
+    def __init__(self, body, content_hash=None, not_modified=False):
+        self.body = body
+        self.content_hash = content_hash
+        self.not_modified = not_modified
+
+
+async def _in_executor(func, *args):
+    return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+async def _replay_page(url):
+    cache = get_page_cache()
+    cached = None
+    if cache is not None:
+        cached = await _in_executor(cache.latest, url)
+    if cached is None:
+        raise PageNotCachedError(url)
+    return _Page(cached[0])
+
+
+def _conditional_headers(validators):
+    headers = {}
+    if validators is not None:
+        _, etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+_MAX_REDIRECTS = 10
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+async def _request_once(url, req_headers, page_type=None):
+    """Sends a GET request for the given url, following redirects, and
+    returns the final response, with its body decompressed."""
+    for _ in range(_MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        pool = _get_pool(parts.scheme, parts.netloc)
+        async with get_host_limiter(parts.hostname).slot() as slot:
+            response = await pool.request(path, req_headers)
+            slot.status = response.status
+        transferred = len(response.body)
+        if response.status not in (204, 304):
+            response.body = _decode_body(
+                response.body, response.getheader('Content-Encoding'))
+        _record_bandwidth(
+            parts.hostname, page_type, transferred, len(response.body))
+        location = response.getheader('Location')
+        if response.status in _REDIRECT_CODES and location:
+            url = urljoin(url, location)
+            continue
+        if response.status >= 400:
+            raise HTTPError(
+                url, response.status, response.reason, response.headers, None)
+        return response
+    raise HTTPError(url, response.status, 'Too many redirects',
+                    response.headers, None)
+
+
+async def _timed_request(url, req_headers, page_type=None):
+    start = asyncio.get_event_loop().time()
+    response = await _request_once(url, req_headers, page_type)
+    _record_latency(urlsplit(url).hostname, page_type,
+                    asyncio.get_event_loop().time() - start)
+    return response
+
+
+async def _hedged_request(url, req_headers, page_type=None):
+    """Like _request_once, but when hedging is on and the request takes
+    longer than usual for its host and page type, sends a duplicate request
+    and returns the first successful response. Hedges are only sent when the
+    rate limiter of the host has spare budget for them."""
+    enabled, percentile = _get_hedging()
+    host = urlsplit(url).hostname
+    delay = _hedge_delay(host, page_type, percentile) if enabled else None
+    if delay is None:
+        return await _timed_request(url, req_headers, page_type)
+    tasks = [asyncio.ensure_future(
+        _timed_request(url, req_headers, page_type))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not get_host_limiter(host).can_send_now():
+            return await tasks[0]
+        tasks.append(asyncio.ensure_future(
+            _timed_request(url, req_headers, page_type)))
+        _count_hedge(host, 'sent')
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is tasks[1]:
+                        _count_hedge(host, 'won')
+                    return task.result()
+        return tasks[0].result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _request(url, req_headers, page_type=None):
+    """Like _hedged_request, but retries the request on transient failures,
+    as long as the circuit breaker of the host allows."""
+    return await with_retries(
+        urlsplit(url).hostname,
+        lambda: _hedged_request(url, req_headers, page_type))
+
+
+async def _fetch_async(url, headers=None, page_type=None):
+    if is_replay_mode():
+        return await _replay_page(url)
+    req_headers = _get_headers()
+    if headers is not None:
+        req_headers.update(headers)
+    cache = get_page_cache()
+    validators = None
+    if cache is not None:
+        validators = await _in_executor(cache.validators, url)
+        req_headers.update(_conditional_headers(validators))
+    response = await _request(url, req_headers, page_type)
+    if response.status == 304 and validators is not None:
+        content_hash = validators[0]
+        body = await _in_executor(cache.revalidated, url, content_hash)
+        if body is not None:
+            return _Page(body, content_hash, not_modified=True)
+        # the cached contents are gone; fetch the page unconditionally
+        for header in _conditional_headers(validators):
+            del req_headers[header]
+        response = await _request(url, req_headers, page_type)
+    content_hash = None
+    if cache is not None:
+        content_hash = await _in_executor(
+            cache.store, url, response.body, None,
+            response.getheader('ETag'), response.getheader('Last-Modified'))
+    return _Page(response.body, content_hash)
+
+
+async def fetch_page_async(url, headers=None, page_type=None):
+    """Returns the raw body of the page at the given url.
+
+    Bandwidth used by the request is accounted for under the host of the url
+    and the given page type. Compressed transfer is negotiated by default,
+    and the returned body is always decompressed.
+
+    Every request waits on the rate limiter of its host, and is retried on
+    transient failures with a jittered exponential backoff. Redirects are
+    followed and HTTP error codes raise an urllib.error.HTTPError, as with
+    urllib.request.urlopen. Fetched pages are stored in the page cache, and
+    in replay mode are read from it instead. Pages already in the cache are
+    revalidated with the ETag and Last-Modified validators they were served
+    with, and are not downloaded again if unchanged."""
+    return (await _fetch_async(url, headers, page_type)).body
+
+
+async def _parse(body):
+    # parsing is done in the loop's default executor, so that the event
+    # loop keeps serving other requests meanwhile
+    return await _in_executor(bs, body, "html.parser")
+
+
+async def fetch_soup_async(url, page_type=None):
+    """Returns a parsed BeautifulSoup object of the page at the given
+    url."""
+    return await _parse(await fetch_page_async(url, page_type=page_type))
+
+
+def _parse_and_extract(body, extract):
+    return extract(bs(body, "html.parser"))
+
+
+_EXTRACTOR_VERSION = get_versions()['version']
+
+def _extractor_key(extract):
+    return '{}.{}@{}'.format(
+        extract.__module__, extract.__qualname__, _EXTRACTOR_VERSION)
+
+
+async def fetch_extracted_async(url, extract, page_type=None,
+                                on_fetched=None):
+    """Returns the properties the given extract function, accepting a parsed
+    BeautifulSoup object, extracts from the page at the given url. If given,
+    on_fetched is called with the raw body of the page as soon as it is
+    fetched, before the page is extracted.
+
+    Extracted properties are stored in the page cache, and when the page is
+    found unchanged on a later fetch they are returned without parsing the
+    page again. Stored properties are tied to the installed holcrawl version,
+    and are never used in replay mode."""
+    page = await _fetch_async(url, page_type=page_type)
+    if on_fetched is not None:
+        on_fetched(page.body)
+    cache = get_page_cache()
+    key = _extractor_key(extract)
+    if page.not_modified:
+        props = await _in_executor(cache.extraction, page.content_hash, key)
+        if props is not None:
+            return props
+    props = await _in_executor(_parse_and_extract, page.body, extract)
+    if page.content_hash is not None:
+        await _in_executor(
+            cache.store_extraction, page.content_hash, key, props)
+    return props
+
+
+def fetch_page(url, headers=None, page_type=None):
+    """Returns the raw body of the page at the given url."""
+    return run_sync(fetch_page_async(url, headers, page_type))
+
+
+def fetch_soup(url, page_type=None):
+    """Returns a parsed BeautifulSoup object of the page at the given url."""
+    return run_sync(fetch_soup_async(url, page_type))
@@ -0,0 +1,298 @@
+"""A shared queue of crawl tasks, for crawling a title list from many nodes.
+
+The frontier is an SQLite database, normally placed on a filesystem shared
+by all crawling nodes, holding a (title, year, source) task per title to
+crawl from each source. Workers claim tasks under leases that expire after
+a while, extending them with heartbeats for as long as they work on them,
+and release them once done. Tasks whose lease expires, because the node
+working on them died, are claimed again by other workers, while tasks that
+keep failing are given up on after a bounded number of attempts."""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import threading
+import collections
+
+from tqdm import tqdm
+
+from holcrawl import imdb_crawl
+from holcrawl import metacritic_crawl
+from holcrawl.engine import run_sync
+from holcrawl.shared import (
+    _get_cfg,
+    _CfgKey,
+    _get_frontier_file_path,
+    _result
+)
+
+
+DEFAULT_LEASE = 300
+DEFAULT_MAX_ATTEMPTS = 3
+_POLL_INTERVAL = 5
+_NO_YEAR = 0
+_DB_TIMEOUT = 60
+
+_CRAWLERS = {
+    'imdb': imdb_crawl.crawl_by_title_async,
+    'metacritic': metacritic_crawl.crawl_by_title_async,
+}
+SOURCES = sorted(_CRAWLERS)
+
+# results that will not change by crawling the title again
+_FINAL_RESULTS = (_result.SUCCESS, _result.EXIST)
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS tasks ("
+    " source TEXT, title TEXT, year INTEGER, state TEXT, owner TEXT,"
+    " lease_expires REAL, attempts INTEGER, result TEXT,"
+    " PRIMARY KEY (source, title, year))",
+    "CREATE INDEX IF NOT EXISTS tasks_by_state ON tasks (state)",
+]
+
+
+# a claimed task, with the number of times it was claimed so far
+Task = collections.namedtuple('Task', ['title', 'year', 'source', 'attempts'])
+
+
+class _state:
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+    ALL_TYPES = [PENDING, LEASED, DONE, FAILED]
+
+
+class Frontier(object):
+    """A queue of crawl tasks stored in the SQLite database at the given
+    path. Safe to use from multiple threads, processes and nodes."""
+
+    def __init__(self, file_path, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.file_path = file_path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)),
+                    exist_ok=True)
+        self._lock = threading.Lock()
+        # WAL mode is avoided, as it does not work over network filesystems
+        self._db = sqlite3.connect(
+            file_path, timeout=_DB_TIMEOUT, isolation_level=None,
+            check_same_thread=False)
+        with self._transaction():
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+
+    def _transaction(self):
+        return _Transaction(self._db, self._lock)
+
+    def enqueue(self, tasks):
+        """Adds the given (title, year, source) tasks to the frontier,
+        ignoring tasks already in it, and returns the number added."""
+        rows = [(source, title, _NO_YEAR if year is None else year,
+                 _state.PENDING, 0)
+                for title, year, source in tasks]
+        with self._transaction():
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO tasks (source, title, year, state, "
+                "attempts) VALUES (?, ?, ?, ?, ?)", rows)
+            return self._db.total_changes - before
+
+    def claim(self, owner, lease=DEFAULT_LEASE, count=1):
+        """Leases up to count pending tasks, or tasks whose lease expired, to
+        the given owner, returning them as Task tuples."""
+        now = time.time()
+        with self._transaction():
+            rows = self._db.execute(
+                "SELECT source, title, year, attempts FROM tasks WHERE "
+                "state = ? OR (state = ? AND lease_expires < ?) "
+                "ORDER BY rowid LIMIT ?",
+                (_state.PENDING, _state.LEASED, now, count)).fetchall()
+            self._db.executemany(
+                "UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE source = ? AND title = ? AND "
+                "year = ?",
+                [(_state.LEASED, owner, now + lease) + tuple(row[:3])
+                 for row in rows])
+        return [Task(title, None if year == _NO_YEAR else year, source,
+                     attempts + 1)
+                for source, title, year, attempts in rows]
+
+    def heartbeat(self, owner, lease=DEFAULT_LEASE):
+        """Extends the leases of all tasks held by the given owner."""
+        with self._transaction():
+            self._db.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE state = ? AND "
+                "owner = ?", (time.time() + lease, _state.LEASED, owner))
+
+    def release(self, owner, task, result):
+        """Releases a task held by the given owner with the result crawling
+        it ended with, returning the state the task is left in, or None if
+        the owner no longer held it. Tasks that may yet succeed are made
+        pending again, unless they were attempted too many times already;
+        tasks skipped for failing recently are given up on."""
+        key = (task.source, task.title,
+               _NO_YEAR if task.year is None else task.year)
+        with self._transaction():
+            row = self._db.execute(
+                "SELECT attempts FROM tasks WHERE source = ? AND title = ? "
+                "AND year = ? AND state = ? AND owner = ?",
+                key + (_state.LEASED, owner)).fetchone()
+            if row is None:  # the lease expired and was taken over
+                return None
+            if result in _FINAL_RESULTS:
+                state = _state.DONE
+            elif result == _result.KNOWN_FAILURE or \
+                    row[0] >= self.max_attempts:
+                state = _state.FAILED
+            else:
+                state = _state.PENDING
+            self._db.execute(
+                "UPDATE tasks SET state = ?, owner = NULL, lease_expires = "
+                "NULL, result = ? WHERE source = ? AND title = ? AND "
+                "year = ?", (state, result) + key)
+        return state
+
+    def unfinished(self):
+        """Returns the number of tasks pending or being worked on."""
+        with self._transaction():
+            return self._db.execute(
+                "SELECT COUNT(*) FROM tasks WHERE state IN (?, ?)",
+                (_state.PENDING, _state.LEASED)).fetchone()[0]
+
+    def stats(self):
+        """Returns a mapping of each source to a count of its tasks by
+        state."""
+        with self._transaction():
+            rows = self._db.execute(
+                "SELECT source, state, COUNT(*) FROM tasks "
+                "GROUP BY source, state").fetchall()
+        stats = {}
+        for source, state, count in rows:
+            counts = stats.setdefault(
+                source, {state: 0 for state in _state.ALL_TYPES})
+            counts[state] = count
+        return stats
+
+
+class _Transaction(object):
+    """Holds a write lock on the database for its duration, so that tasks are
+    never claimed by two workers."""
+
+    def __init__(self, db, lock):
+        self.db = db
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.db
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.lock.release()
+        return False
+
+
+def get_frontier(file_path=None):
+    """Returns the frontier at the given path, defaulting to the configured
+    frontier_path, or to the frontier under the data directory."""
+    if file_path is None:
+        file_path = _get_cfg().get(
+            _CfgKey.FRONTIER_PATH, _get_frontier_file_path())
+    return Frontier(file_path)
+
+
+def enqueue_titles(titles, year=None, sources=None, frontier_path=None):
+    """Adds a task to crawl each of the given titles from each of the given
+    sources (all sources by default) to the frontier, returning the number
+    of tasks added."""
+    sources = sources or SOURCES
+    return get_frontier(frontier_path).enqueue(
+        (title, year, source) for source in sources for title in titles)
+
+
+# === working ===
+
+def _worker_id():
+    return '{}:{}:{}'.format(
+        socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+async def _in_executor(func, *args):
+    return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+async def _heartbeat(frontier, owner, lease):
+    while True:
+        await asyncio.sleep(lease / 3)
+        await _in_executor(frontier.heartbeat, owner, lease)
+
+
+async def _work_async(frontier, owner, verbose, workers, lease, pbar):
+    results = {res_type : 0 for res_type in _result.ALL_TYPES}
+
+    async def _worker():
+        while True:
+            tasks = await _in_executor(frontier.claim, owner, lease)
+            if not tasks:
+                # tasks leased to other nodes may yet come back
+                if await _in_executor(frontier.unfinished) == 0:
+                    return
+                await asyncio.sleep(_POLL_INTERVAL)
+                continue
+            task = tasks[0]
+            try:
+                # retried tasks failed before, so the failure log would
+                # skip them
+                result = await _CRAWLERS[task.source](
+                    task.title, verbose, task.year, pbar,
+                    force=task.attempts > 1)
+            except Exception:  # pylint: disable=W0703
+                result = _result.FAILURE
+            state = await _in_executor(
+                frontier.release, owner, task, result)
+            # only the last attempt at a task counts toward its outcome
+            if state in (_state.DONE, _state.FAILED):
+                results[result] += 1
+                pbar.update(1)
+
+    heartbeat = asyncio.ensure_future(_heartbeat(frontier, owner, lease))
+    try:
+        await asyncio.gather(*[_worker() for _ in range(max(1, workers))])
+    finally:
+        heartbeat.cancel()
+    return results
+
+
+def work(verbose, workers=1, lease=DEFAULT_LEASE, frontier_path=None):
+    """Crawls tasks claimed from the frontier, with up to workers tasks
+    crawled concurrently, until no unfinished tasks remain in it."""
+    frontier = get_frontier(frontier_path)
+    owner = _worker_id()
+    if verbose:
+        print("Working on {} as {}...".format(frontier.file_path, owner))
+    pbar = tqdm(miniters=1, maxinterval=0.0001, mininterval=0.00000000001)
+    results = run_sync(_work_async(
+        frontier, owner, verbose, workers, lease, pbar))
+    pbar.close()
+    print("{} tasks crawled.".format(sum(results.values())))
+    for res_type in _result.ALL_TYPES:
+        print('{} {}.'.format(results[res_type], res_type))
+
+
+def print_frontier_stats(frontier_path=None):
+    """Prints a count of the tasks in the frontier by source and state."""
+    stats = get_frontier(frontier_path).stats()
+    for source in sorted(stats):
+        print("{}: {}".format(source, ', '.join(
+            '{} {}'.format(stats[source][state], state)
+            for state in _state.ALL_TYPES)))
@@ -3,23 +3,49 @@
 import sys
 import re
 import os
+import functools
+import collections
 from datetime import datetime
-from urllib import request
-import urllib
+import urllib.parse
 import traceback
 
-from bs4 import BeautifulSoup as bs
 from tqdm import tqdm
 import pandas as pd
 import morejson as json
 
+from holcrawl.engine import run_sync
+from holcrawl.fetch import (
+    fetch_soup_async,
+    fetch_extracted_async,
+    bandwidth_stats,
+    print_bandwidth_stats,
+    is_replay_mode
+)
+from holcrawl.imdb_index import get_imdb_index
 from holcrawl.shared import (
     _get_imdb_dir_path,
     _titles_from_file,
+    _crawl_titles,
     _result,
     _parse_string,
     _parse_name_for_file_name,
-    _get_dataset_dir_path
+    _get_dataset_dir_path,
+    _with_deadline,
+    _get_movie_deadline,
+    _get_resolution_file_path,
+    _PersistentMap,
+    _FailureLog,
+    _journaled,
+    _file_job_name,
+    _gather_subpages,
+    _record_fetch_times,
+    _is_partial,
+    _missing_subpages,
+    _save_profile,
+    _subpages_for_fields,
+    SubPagesError,
+    MovieNotFoundError,
+    DeadlineExceededError
 )
 
 _IMDB_DIR_PATH = _get_imdb_dir_path()
@@ -178,9 +204,7 @@ def _extract_table(table):
 
 _RATINGS_URL = 'http://www.imdb.com/title/{code}/ratings'
 
-def _get_rating_props(movie_code):
-    cur_ratings_url = _RATINGS_URL.format(code=movie_code)
-    ratings_page = bs(request.urlopen(cur_ratings_url), "html.parser")
+def _extract_rating_props(ratings_page):
     tables = ratings_page.find_all("table")
     hist_table = tables[0]
     hist_content = _extract_table(hist_table)
@@ -204,15 +228,19 @@ def _get_rating_props(movie_code):
     return rating_props
 
 
+async def _get_rating_props(movie_code):
+    cur_ratings_url = _RATINGS_URL.format(code=movie_code)
+    return await fetch_extracted_async(
+        cur_ratings_url, _extract_rating_props, 'ratings')
+
+
 # ==== crawling the business page ====
 
 _BUSINESS_URL = 'http://www.imdb.com/title/{code}/business?ref_=tt_dt_bus'
 _WEEKEND_CONTENT_REGEX = r"<h5>Weekend Gross</h5>([\s\S]+?)<h[0-9]>"
 _US_OPEN_WEEKEND_REGEX = r"\$[\s\S]*?\(USA\)[\s\S]*?\(([0-9,]*) Screens\)"
 
-def _get_business_props(movie_code):
-    cur_business_url = _BUSINESS_URL.format(code=movie_code)
-    busi_page = bs(request.urlopen(cur_business_url), "html.parser")
+def _extract_business_props(busi_page):
     busi_str = str(busi_page)
     weekend_contents = re.findall(_WEEKEND_CONTENT_REGEX, busi_str)[0]
     num_screens_list = [
@@ -229,15 +257,19 @@ def _get_business_props(movie_code):
     return busi_props
 
 
+async def _get_business_props(movie_code):
+    cur_business_url = _BUSINESS_URL.format(code=movie_code)
+    return await fetch_extracted_async(
+        cur_business_url, _extract_business_props, 'business')
+
+
 # ==== crawling the release page ====
 
 _RELEASE_URL = 'http://www.imdb.com/title/{code}/releaseinfo'
 _USA_ROW_REGEX = r"<tr[\s\S]*?USA[\s\S]*?(\d\d?)\s+([a-zA-Z]+)"\
                 r"[\s\S]*?(\d\d\d\d)[\s\S]*?<td></td>[\s\S]*?</tr>"
 
-def _get_release_props(movie_code):
-    cur_release_url = _RELEASE_URL.format(code=movie_code)
-    release_page = bs(urllib.request.urlopen(cur_release_url), "html.parser")
+def _extract_release_props(release_page):
     release_table = release_page.find_all("table", {"id": "release_dates"})[0]
     us_rows = []
     for row in release_table.find_all("tr")[1:]:
@@ -257,15 +289,19 @@ def _get_release_props(movie_code):
     return release_props
 
 
+async def _get_release_props(movie_code):
+    cur_release_url = _RELEASE_URL.format(code=movie_code)
+    return await fetch_extracted_async(
+        cur_release_url, _extract_release_props, 'release')
+
+
 # ==== crawling the user reviews page ====
 
 _REVIEWS_URL = ('http://www.imdb.com/title/{code}/'
                 'reviews-index?start=0;count=9999')
 _USER_REVIEW_RATING_REGEX = r"alt=\"(\d|10)/10"
 
-def _get_reviews_props(movie_code):
-    cur_reviews_url = _REVIEWS_URL.format(code=movie_code)
-    reviews_page = bs(urllib.request.urlopen(cur_reviews_url), "html.parser")
+def _extract_reviews_props(reviews_page):
     reviews = reviews_page.find_all("td", {"class": "comment-summary"})
     user_reviews = []
     for review in reviews:
@@ -287,6 +323,57 @@ def _get_reviews_props(movie_code):
     return {'imdb_user_reviews': user_reviews}
 
 
+async def _get_reviews_props(movie_code):
+    cur_reviews_url = _REVIEWS_URL.format(code=movie_code)
+    return await fetch_extracted_async(
+        cur_reviews_url, _extract_reviews_props, 'reviews')
+
+
+_NEW_REVIEWS_URL = ('http://www.imdb.com/title/{code}/'
+                    'reviews-index?filter=chrono;start={start};count={count}')
+_NEW_REVIEWS_PAGE_SIZE = 100
+_MAX_NEW_REVIEWS_PAGES = 100
+
+def _extract_reviews_page(reviews_page):
+    # pages are paginated by review rows, parsed or not
+    props = _extract_reviews_props(reviews_page)
+    props['num_rows'] = len(
+        reviews_page.find_all("td", {"class": "comment-summary"}))
+    return props
+
+
+def _review_key(review):
+    return review['user'], review['review_date'], review['contents']
+
+
+async def _get_new_reviews_props(movie_code, known_reviews):
+    """Fetches user reviews newest first, page by page, until reaching
+    reviews among the given known ones, and returns the known reviews with
+    the new ones appended to them, in the order they were fetched."""
+    known_keys = set(_review_key(review) for review in known_reviews)
+    newest_known = max(
+        (review['review_date'] for review in known_reviews), default=None)
+    new_reviews = []
+    for page in range(_MAX_NEW_REVIEWS_PAGES):
+        page_url = _NEW_REVIEWS_URL.format(
+            code=movie_code, start=page * _NEW_REVIEWS_PAGE_SIZE,
+            count=_NEW_REVIEWS_PAGE_SIZE)
+        page_props = await fetch_extracted_async(
+            page_url, _extract_reviews_page, 'reviews')
+        page_reviews = page_props['imdb_user_reviews']
+        reached_known = False
+        for review in page_reviews:
+            if _review_key(review) in known_keys or (
+                    newest_known is not None and
+                    review['review_date'] < newest_known):
+                reached_known = True
+                continue
+            new_reviews.append(review)
+        if reached_known or page_props['num_rows'] < _NEW_REVIEWS_PAGE_SIZE:
+            break
+    return {'imdb_user_reviews': list(known_reviews) + new_reviews}
+
+
 # ==== crawling a movie profile ====
 
 _TITLE_QUERY = (
@@ -301,15 +388,25 @@ def _convert_title(title):
     return urllib.parse.quote(title).lower()
 
 
-def crawl_movie_profile(movie_name, year=None):
-    """Returns a basic profile for the given movie."""
+_MOVIE_CODES = _PersistentMap(_get_resolution_file_path('imdb_codes'))
+
+async def _get_movie_code(movie_name, year=None):
+    movie_code = _MOVIE_CODES.get(movie_name, year)
+    if movie_code is None and get_imdb_index() is not None:
+        movie_code = get_imdb_index().movie_code(movie_name, year)
+    if movie_code is None:
+        movie_code = await _search_movie_code(movie_name, year)
+        if movie_code is not None:
+            _MOVIE_CODES.put(movie_name, year, movie_code)
+    return movie_code
 
-    # Search
+
+async def _search_movie_code(movie_name, year=None):
     query = _TITLE_QUERY.format(title=_convert_title(movie_name))
-    search_res = bs(request.urlopen(query), "html.parser")
+    search_res = await fetch_soup_async(query, 'search')
     tables = search_res.find_all("table", {"class": "findList"})
     if len(tables) < 1:
-        return {}
+        return None
     res_table = tables[0]
     if year is None:
         movie_row = res_table.find_all("tr")[0]
@@ -317,15 +414,11 @@ def crawl_movie_profile(movie_name, year=None):
         for row in res_table.find_all("tr"):
             if (str(year) in str(row)) or (str(year-1) in str(row)):
                 movie_row = row
-    movie_code = re.findall(_MOVIE_CODE_REGEX, str(movie_row))[0]
+    return re.findall(_MOVIE_CODE_REGEX, str(movie_row))[0]
 
-    # Movie Profile
-    cur_profile_url = _PROFILE_URL.format(code=movie_code)
-    prof_page = bs(request.urlopen(cur_profile_url), "html.parser")
 
-    # Extracting properties
+def _extract_profile_props(prof_page):
     props = {}
-    props['name'] = movie_name
     props['rating'] = _get_rating(prof_page)
     props['rating_count'] = _get_rating_count(prof_page)
     props['genres'] = _get_geners(prof_page)
@@ -335,17 +428,104 @@ def crawl_movie_profile(movie_name, year=None):
     props['year'] = _get_year(prof_page)
     props['duration'] = _get_duration(prof_page)
     props.update(_get_box_office_props(prof_page))
-    props.update(_get_rating_props(movie_code))
-    props.update(_get_business_props(movie_code))
-    props.update(_get_release_props(movie_code))
-    props.update(_get_reviews_props(movie_code))
     return props
 
 
+async def _get_profile_props(movie_code):
+    cur_profile_url = _PROFILE_URL.format(code=movie_code)
+    return await fetch_extracted_async(
+        cur_profile_url, _extract_profile_props, 'profile')
+
+
+_SUBPAGES = collections.OrderedDict([
+    ('profile', _get_profile_props),
+    ('ratings', _get_rating_props),
+    ('business', _get_business_props),
+    ('release', _get_release_props),
+    ('reviews', _get_reviews_props),
+])
+
+# the profile fields each sub-page produces
+_FIELDS = collections.OrderedDict([
+    ('profile', (
+        'rating', 'rating_count', 'genres', 'user_review_count',
+        'critic_review_count', 'metascore', 'year', 'duration', 'budget',
+        'budget_currency', 'opening_weekend_date', 'opening_weekend_income',
+        'opening_weekend_income_currency', 'closing_date', 'gross_income')),
+    ('ratings', ('rating_freq', 'votes_per_demo', 'avg_rating_per_demo')),
+    ('business', (
+        'screens_by_weekend', 'opening_weekend_screens', 'max_screens',
+        'total_screens', 'avg_screens', 'num_weekends')),
+    ('release', ('release_day', 'release_month', 'release_year')),
+    ('reviews', ('imdb_user_reviews',)),
+])
+FIELDS = [field for fields in _FIELDS.values() for field in fields]
+
+def _subpages_for(fields=None):
+    return _subpages_for_fields(_FIELDS, fields)
+
+
+async def crawl_movie_profile_async(movie_name, year=None, fields=None):
+    """Returns a basic profile for the given movie.
+
+    Once the movie is found, all of its IMDB pages are fetched concurrently,
+    or, if profile fields are given, only the pages producing them. If any
+    of them fails, a SubPagesError holding the properties extracted from the
+    rest is raised. Unknown profile fields raise a ValueError."""
+    subpages = _subpages_for(fields)
+    movie_code = await _get_movie_code(movie_name, year)
+    if movie_code is None:
+        return {}
+    getters = collections.OrderedDict(
+        (subpage, _SUBPAGES[subpage]) for subpage in subpages)
+    try:
+        props = await _gather_subpages(getters, movie_code)
+    except SubPagesError as exc:
+        exc.props['name'] = movie_name
+        raise
+    props['name'] = movie_name
+    return props
+
+
+async def crawl_subpages_async(movie_name, year, subpages, profile=None,
+                               on_done=None):
+    """Crawls only the given IMDB sub-pages of the given movie, returning the
+    properties extracted from them.
+
+    If the existing profile of the movie is given, only user reviews newer
+    than those in it are fetched, and merged into them. If given, on_done is
+    called with the name and properties of each sub-page once crawled."""
+    movie_code = await _get_movie_code(movie_name, year)
+    if movie_code is None:
+        raise MovieNotFoundError(movie_name)
+    getters = collections.OrderedDict(
+        (subpage, _SUBPAGES[subpage]) for subpage in subpages)
+    if 'reviews' in getters and profile and profile.get('imdb_user_reviews'):
+        getters['reviews'] = functools.partial(
+            _get_new_reviews_props, known_reviews=profile['imdb_user_reviews'])
+    return await _gather_subpages(getters, movie_code, on_done=on_done)
+
+
+def crawl_movie_profile(movie_name, year=None, fields=None):
+    """Returns a basic profile for the given movie, holding only the given
+    profile fields, and those fetched along with them, if given."""
+    return run_sync(crawl_movie_profile_async(movie_name, year, fields))
+
+
 # ==== interface ====
 
-def crawl_by_title(movie_name, verbose, year=None, parent_pbar=None):
-    """Extracts a movie profile from IMDB and saves it to disk."""
+_FAILURES = _FailureLog('imdb')
+
+# profiles are dumped with these keyword arguments
+_DUMP_KWARGS = {'indent': 2}
+
+# profiles missing some sub-pages are marked with them under this key
+_MISSING_KEY = 'missing_subpages'
+
+async def crawl_by_title_async(movie_name, verbose, year=None,
+                               parent_pbar=None, force=False):
+    """Extracts a movie profile from IMDB and saves it to disk. Titles that
+    failed recently are skipped, unless forced."""
     def _print(msg):
         if verbose:
             if parent_pbar is not None:
@@ -359,43 +539,84 @@ def crawl_by_title(movie_name, verbose, year=None, parent_pbar=None):
     os.makedirs(_IMDB_DIR_PATH, exist_ok=True)
     file_name = _parse_name_for_file_name(movie_name) + '.json'
     file_path = os.path.join(_IMDB_DIR_PATH, file_name)
-    if os.path.isfile(file_path):
-        _print('{} already processed'.format(movie_name))
+    subpages = _subpages_for()
+    if not subpages:
+        _print('No IMDB fields selected for {}'.format(movie_name))
         return _result.EXIST
+    if os.path.isfile(file_path) and not is_replay_mode():
+        # partial profiles are completed with the sub-pages they miss
+        subpages = _missing_subpages(file_path, _MISSING_KEY, subpages)
+        if not subpages:
+            _print('{} already processed'.format(movie_name))
+            return _result.EXIST
+    if not is_replay_mode() and not force:
+        reason = _FAILURES.recent_failure(movie_name, year)
+        if reason is not None:
+            _print('{} failed recently ({})'.format(movie_name, reason))
+            return _result.KNOWN_FAILURE
+
+    def _checkpoint(subpage, props):
+        # each sub-page is saved once crawled, so retries crawl only the rest
+        _save_profile(
+            file_path, dict(props, name=movie_name), _MISSING_KEY, _SUBPAGES,
+            [subpage], **_DUMP_KWARGS)
+        _record_fetch_times('imdb', file_name, movie_name, year, [subpage])
 
     # _print("Extracting a profile for {} from IMDB...".format(movie_name))
     try:
-        props = crawl_movie_profile(movie_name, year)
-        # _print("Profile extracted succesfully")
-        # _print("Saving profile for {} to disk...".format(movie_name))
-        with open(file_path, 'w+') as json_file:
-            # json.dump(props, json_file, cls=_RottenJsonEncoder, indent=2)
-            json.dump(props, json_file, indent=2)
+        await _with_deadline(
+            crawl_subpages_async(
+                movie_name, year, subpages, on_done=_checkpoint),
+            _get_movie_deadline())
+        _FAILURES.clear(movie_name, year)
         _print("Done saving a profile for {}.".format(movie_name))
         return _result.SUCCESS
+    except DeadlineExceededError as exc:
+        _FAILURES.record(movie_name, year, exc)
+        _print("Extracting a profile for {} timed out".format(movie_name))
+        return _result.TIMEOUT
+    except SubPagesError as exc:
+        _FAILURES.record(movie_name, year, exc)
+        _print("Extracting a profile for {} failed on {}".format(
+            movie_name, ', '.join(exc.errors)))
+        return _result.FAILURE
     except Exception as exc:
-        _print("Extracting a profile for {} failed".format(movie_name))
+        reason = _FAILURES.record(movie_name, year, exc)
+        _print("Extracting a profile for {} failed ({})".format(
+            movie_name, reason))
         # traceback.print_exc()
         return _result.FAILURE
         # print("Extracting a profile for {} failed with:".format(movie_name))
         # raise exc
 
 
-def crawl_by_file(file_path, verbose, year=None):
-    """Crawls IMDB and builds movie profiles for a movies in the given file."""
-    results = {res_type : 0 for res_type in _result.ALL_TYPES}
+def crawl_by_title(movie_name, verbose, year=None, parent_pbar=None):
+    """Extracts a movie profile from IMDB and saves it to disk."""
+    return run_sync(crawl_by_title_async(
+        movie_name, verbose, year, parent_pbar))
+
+
+def crawl_by_file(file_path, verbose, year=None, workers=1):
+    """Crawls IMDB and builds movie profiles for a movies in the given file.
+
+    Up to workers titles are crawled concurrently."""
+    if not _subpages_for():
+        print("No IMDB profile fields selected; skipping IMDB.")
+        return
     titles = _titles_from_file(file_path)
     if verbose:
         print("Crawling over all {} IMDB movies in {}...".format(
             len(titles), file_path))
-    movie_pbar = tqdm(titles, miniters=1, maxinterval=0.0001,
-                      mininterval=0.00000000001, total=len(titles))
-    for title in movie_pbar:
-        res = crawl_by_title(title, verbose, year, movie_pbar)
-        results[res] += 1
-    print("{} IMDB movie profiles crawled.".format(len(titles)))
+    with _journaled(_file_job_name('imdb_byfile', file_path)):
+        results = _crawl_titles(
+            crawl_by_title_async, titles, verbose, year, workers,
+            source='imdb')
+    print("{} IMDB movie profiles crawled.".format(
+        sum(results.values())))
     for res_type in _result.ALL_TYPES:
         print('{} {}.'.format(results[res_type], res_type))
+    if verbose and bandwidth_stats():
+        print_bandwidth_stats()
 
 
 # === uniting movie profiles to csv ===
@@ -445,7 +666,8 @@ def _dummy_list_column(df, colname):
 
 
 def unite_imdb_profiles(verbose):
-    """Unite all movie profiles in the IMDB profile directory."""
+    """Unite all movie profiles in the IMDB profile directory, skipping
+    partial profiles missing some of their pages."""
     if verbose:
         print("Uniting IMDB movie profiles to one csv file...")
     if not os.path.exists(_IMDB_DIR_PATH):
@@ -462,7 +684,9 @@ def unite_imdb_profiles(verbose):
         _, ext = os.path.splitext(file_path)
         if ext == '.json':
             with open(file_path, 'r') as json_file:
-                profiles.append(json.load(json_file))
+                profile = json.load(json_file)
+            if not _is_partial(profile, _MISSING_KEY):
+                profiles.append(profile)
     df = pd.DataFrame(profiles)
     df = _decompose_dict_column(df, 'avg_rating_per_demo', _DEMOGRAPHICS)
     df = _decompose_dict_column(df, 'votes_per_demo', _DEMOGRAPHICS)
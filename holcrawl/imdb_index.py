@@ -0,0 +1,152 @@
+"""An offline index of IMDB movie codes, built from IMDb dataset dumps.
+
+The index is built by stream-parsing a locally downloaded
+title.basics.tsv.gz file (see https://www.imdb.com/interfaces/) into an
+SQLite database under the data directory, mapping the normalized primary
+and original titles of every movie, together with its start year, to its
+IMDB code. Once built, movie codes are resolved from it without any search
+request; titles it can't resolve unambiguously fall back to searching
+IMDB."""
+
+import os
+import gzip
+import sqlite3
+import threading
+
+from tqdm import tqdm
+
+from holcrawl.shared import (
+    _get_imdb_index_file_path,
+    _normalize_title
+)
+
+
+_TITLE_TYPES = ('movie',)
+_NULL = '\\N'
+_NO_YEAR = 0  # primary key columns of WITHOUT ROWID tables can't be NULL
+_BATCH_SIZE = 50000
+
+# rows are stored in title order only, with no separate rowid and index
+_SCHEMA = [
+    "CREATE TABLE titles (title TEXT, year INTEGER, code TEXT, "
+    "PRIMARY KEY (title, year, code)) WITHOUT ROWID",
+]
+
+
+def _title_rows(tsv_file):
+    """Yields a (normalized title, start year, code) tuple for every title
+    of every movie in the given title.basics.tsv file."""
+    header = tsv_file.readline().rstrip('\n').split('\t')
+    code_ix = header.index('tconst')
+    type_ix = header.index('titleType')
+    primary_ix = header.index('primaryTitle')
+    original_ix = header.index('originalTitle')
+    year_ix = header.index('startYear')
+    for line in tsv_file:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != len(header) or fields[type_ix] not in _TITLE_TYPES:
+            continue
+        year = _NO_YEAR if fields[year_ix] == _NULL else int(
+            fields[year_ix])
+        primary = _normalize_title(fields[primary_ix])
+        yield primary, year, fields[code_ix]
+        original = _normalize_title(fields[original_ix])
+        if original != primary:
+            yield original, year, fields[code_ix]
+
+
+def build_imdb_index(tsv_gz_path, verbose=False):
+    """Builds the offline IMDB index from the title.basics.tsv.gz file at
+    the given path, replacing any existing index."""
+    index_path = _get_imdb_index_file_path()
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    for statement in _SCHEMA:
+        db.execute(statement)
+    count = 0
+    pbar = tqdm(unit=' titles', disable=not verbose)
+    with gzip.open(tsv_gz_path, 'rt', encoding='utf-8') as tsv_file:
+        rows = _title_rows(tsv_file)
+        while True:
+            batch = [row for _, row in zip(range(_BATCH_SIZE), rows)]
+            if not batch:
+                break
+            db.executemany(
+                "INSERT OR IGNORE INTO titles VALUES (?, ?, ?)", batch)
+            count += len(batch)
+            pbar.update(len(batch))
+    pbar.close()
+    db.commit()
+    db.close()
+    os.replace(tmp_path, index_path)
+    _reset_imdb_index()
+    if verbose:
+        print("Indexed {} titles into {}".format(count, index_path))
+    return count
+
+
+class ImdbIndex(object):
+    """A read-only view of an offline IMDB index. Safe to use from multiple
+    threads."""
+
+    def __init__(self, index_path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            'file:{}?mode=ro'.format(index_path), uri=True,
+            check_same_thread=False)
+
+    def _codes(self, title, year):
+        with self._lock:
+            if year is None:
+                rows = self._db.execute(
+                    "SELECT DISTINCT code FROM titles WHERE title = ?",
+                    (title,)).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT DISTINCT code FROM titles WHERE title = ? AND "
+                    "year = ?", (title, year)).fetchall()
+        return [row[0] for row in rows]
+
+    def movie_code(self, movie_name, year=None):
+        """Returns the IMDB code of the given movie, or None if the index
+        holds no single movie of that title and year."""
+        title = _normalize_title(movie_name)
+        if year is None:
+            candidates = [self._codes(title, None)]
+        else:
+            # IMDB search results are matched to the given or previous year
+            candidates = [self._codes(title, year),
+                          self._codes(title, year - 1)]
+        for codes in candidates:
+            if len(codes) == 1:
+                return codes[0]
+            if codes:
+                return None
+        return None
+
+
+_INDEX_OBJ = None
+_INDEX_LOCK = threading.Lock()
+
+def get_imdb_index():
+    """Returns the offline IMDB index of the data directory, or None if it
+    was not built."""
+    global _INDEX_OBJ  # pylint: disable=W0603
+    with _INDEX_LOCK:
+        if _INDEX_OBJ is None:
+            index_path = _get_imdb_index_file_path()
+            if not os.path.exists(index_path):
+                return None
+            _INDEX_OBJ = ImdbIndex(index_path)
+        return _INDEX_OBJ
+
+
+def _reset_imdb_index():
+    global _INDEX_OBJ  # pylint: disable=W0603
+    with _INDEX_LOCK:
+        _INDEX_OBJ = None
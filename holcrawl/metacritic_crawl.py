@@ -3,19 +3,50 @@
 import re
 import os
 import sys
-import urllib
-import urllib.request
+import html
+import asyncio
+import functools
+import collections
+import unicodedata
 from datetime import datetime
+from urllib.error import HTTPError
 
-from bs4 import BeautifulSoup as bs
 from tqdm import tqdm
 import morejson as json
 
+from holcrawl.engine import run_sync
+from holcrawl.fetch import (
+    fetch_soup_async,
+    fetch_extracted_async,
+    bandwidth_stats,
+    print_bandwidth_stats,
+    is_replay_mode,
+    PageNotCachedError
+)
 from holcrawl.shared import (
+    _get_cfg,
+    _CfgKey,
     _get_metacritic_dir_path,
     _result,
     _titles_from_file,
-    _parse_name_for_file_name
+    _crawl_titles,
+    _parse_name_for_file_name,
+    _with_deadline,
+    _get_movie_deadline,
+    _get_resolution_file_path,
+    _normalize_title,
+    _PersistentMap,
+    _FailureLog,
+    _journaled,
+    _file_job_name,
+    _gather_subpages,
+    _record_fetch_times,
+    _missing_subpages,
+    _save_profile,
+    _subpages_for_fields,
+    SubPagesError,
+    MovieNotFoundError,
+    DeadlineExceededError
 )
 
 METACRITIC_DIR_PATH = _get_metacritic_dir_path()
@@ -31,13 +62,11 @@ def _parse_name_for_search(movie_name):
 
 SEARCH_URL = ("http://www.metacritic.com/search/all/{movie_name}/results?"
               "cats%5Bmovie%5D=1&search_type=advanced")
-_HEADERS = {'User-Agent': 'Mozilla/5.0'}
 METACRITIC_URL = "http://www.metacritic.com"
 
-def _get_movie_url_by_name(movie_name, year=None):
+async def _get_movie_url_by_name(movie_name, year=None):
     query = SEARCH_URL.format(movie_name=_parse_name_for_search(movie_name))
-    request = urllib.request.Request(query, headers=_HEADERS)
-    search_res = bs(urllib.request.urlopen(request), "html.parser")
+    search_res = await fetch_soup_async(query, 'mc_search')
     results = search_res.find_all("li", {"class": "result"})
     correct_result = None
     for result in results:
@@ -50,6 +79,8 @@ def _get_movie_url_by_name(movie_name, year=None):
             year_match = str(year) in str(result)
             if title_match and year_match:
                 correct_result = result
+    if correct_result is None:
+        raise MovieNotFoundError(movie_name)
     movie_url_suffix = correct_result.find_all("a")[0]['href']
     return METACRITIC_URL + movie_url_suffix
 
@@ -92,10 +123,7 @@ SCORE_CLASSES = [
     "metascore_w larger movie negative"
 ]
 
-def _get_critics_reviews_props(movie_url):
-    critics_url = movie_url + CRITICS_REVIEWS_URL_SUFFIX
-    critics_request = urllib.request.Request(critics_url, headers=_HEADERS)
-    critics_page = bs(urllib.request.urlopen(critics_request), "html.parser")
+def _extract_critics_reviews_props(critics_page):
     critics_props = {}
     critics_props['metascore'] = int(critics_page.find_all(
         "span", {"class": SCORE_CLASSES})[0].contents[0])
@@ -109,6 +137,101 @@ def _get_critics_reviews_props(movie_url):
     return critics_props
 
 
+async def _get_critics_reviews_props(movie_url):
+    critics_url = movie_url + CRITICS_REVIEWS_URL_SUFFIX
+    return await fetch_extracted_async(
+        critics_url, _extract_critics_reviews_props, 'mc_critic')
+
+
+def _critic_review_key(review):
+    return review['publication'], review['critic'], review['review_date']
+
+
+async def _get_new_critics_reviews_props(movie_url, known_reviews):
+    """Returns the critic reviews properties of the given movie, with the
+    reviews not among the given known ones appended to them."""
+    critics_props = await _get_critics_reviews_props(movie_url)
+    known_keys = set(_critic_review_key(review) for review in known_reviews)
+    critics_props['pro_critic_reviews'] = list(known_reviews) + [
+        review for review in critics_props['pro_critic_reviews']
+        if _critic_review_key(review) not in known_keys]
+    return critics_props
+
+
+# === movie url resolution ===
+
+_MOVIE_URLS = _PersistentMap(_get_resolution_file_path('metacritic_urls'))
+MOVIE_URL = METACRITIC_URL + "/movie/{slug}"
+
+def _movie_slug(movie_name):
+    ascii_name = unicodedata.normalize('NFKD', movie_name).encode(
+        'ascii', 'ignore').decode('ascii')
+    slug = re.sub(r"[^a-z0-9\- ]", '', ' '.join(ascii_name.lower().split()))
+    return slug.replace(' ', '-')
+
+
+def _extract_critics_page(critics_page):
+    page_props = {'title': None, 'release_date': None, 'critics': None}
+    titles = critics_page.find_all("h1")
+    if titles:
+        page_props['title'] = titles[0].get_text()
+    release_dates = critics_page.find_all("span", {"class": "release_date"})
+    if release_dates:
+        page_props['release_date'] = release_dates[0].get_text()
+    try:
+        page_props['critics'] = _extract_critics_reviews_props(critics_page)
+    except Exception:  # pylint: disable=W0703
+        pass
+    return page_props
+
+
+def _is_movie_page(page_props, movie_name, year=None):
+    if page_props['title'] is None or _normalize_title(
+            page_props['title']) != _normalize_title(movie_name):
+        return False
+    return year is None or str(year) in (page_props['release_date'] or '')
+
+
+def _use_slug_prediction():
+    return _get_cfg().get(_CfgKey.METACRITIC_SLUG_PREDICTION, True)
+
+
+async def _predict_movie_url(movie_name, year=None):
+    """Checks the movie url predicted from the given title by fetching its
+    critic reviews page, returning the url and the critic reviews properties
+    found there, or (None, None) if the prediction missed."""
+    movie_url = MOVIE_URL.format(slug=_movie_slug(movie_name))
+    try:
+        page_props = await fetch_extracted_async(
+            movie_url + CRITICS_REVIEWS_URL_SUFFIX, _extract_critics_page,
+            'mc_critic')
+    except HTTPError as exc:
+        if exc.code != 404:
+            raise
+        return None, None
+    except PageNotCachedError:
+        return None, None
+    if not _is_movie_page(page_props, movie_name, year):
+        return None, None
+    return movie_url, page_props['critics']
+
+
+async def _resolve_movie_url(movie_name, year=None):
+    """Returns the url of the given movie on Metacritic, together with its
+    critic reviews properties if these were already crawled while resolving
+    it (or None otherwise)."""
+    movie_url = _MOVIE_URLS.get(movie_name, year)
+    if movie_url is not None:
+        return movie_url, None
+    critics_props = None
+    if _use_slug_prediction():
+        movie_url, critics_props = await _predict_movie_url(movie_name, year)
+    if movie_url is None:
+        movie_url = await _get_movie_url_by_name(movie_name, year)
+    _MOVIE_URLS.put(movie_name, year, movie_url)
+    return movie_url, critics_props
+
+
 # === user reviews page ===
 
 def _get_user_rating_freq(users_page, rating):
@@ -142,36 +265,112 @@ def _get_user_review_props(review):
     return review_props
 
 
-def _get_user_reviews_from_page(users_page):
-    review_elements = users_page.find_all("div", {"class": "review"})
+def _extract_user_reviews(users_page):
     user_reviews = []
-    for review in review_elements:
+    for review in users_page.find_all("div", {"class": "review"}):
         try:
             user_reviews.append(_get_user_review_props(review))
         except Exception:
             continue
-    # print("Extracted {} reviews.".format(len(user_reviews)))
-    nexts = users_page.find_all("a", {"class": "action", "rel": "next"})
-    if len(nexts) > 0:
-        next_url = METACRITIC_URL + nexts[0]['href']
-        next_request = urllib.request.Request(next_url, headers=_HEADERS)
-        next_page = bs(urllib.request.urlopen(next_request), "html.parser")
-        user_reviews += _get_user_reviews_from_page(next_page)
+    return user_reviews
+
+
+def _user_review_key(review):
+    return review['user'], review['review_date']
+
+
+def _extract_users_page(users_page):
+    return {'user_reviews': _extract_user_reviews(users_page)}
+
+
+_NEXT_LINK_RE = re.compile(rb'<a\s[^>]*\brel="next"[^>]*>')
+_HREF_RE = re.compile(rb'\bhref="([^"]*)"')
+
+def _find_next_users_url(body):
+    """Returns the url of the user reviews page following the one of the given
+    raw body, or None if it is the last one. The body is scanned, rather than
+    parsed, so that the next page can be fetched while this one is
+    extracted."""
+    link = _NEXT_LINK_RE.search(body)
+    if link is None:
+        return None
+    href = _HREF_RE.search(link.group(0))
+    if href is None:
+        return None
+    return METACRITIC_URL + html.unescape(href.group(1).decode('utf-8'))
+
+
+def _fetch_users_page(url, extract=_extract_users_page):
+    """Starts extracting the user reviews page at the given url through the
+    page cache. Returns the extraction task, along with a future of the url of
+    the next page, resolved as soon as the page is fetched."""
+    next_url = asyncio.Future()
+
+    def _on_fetched(body):
+        next_url.set_result(_find_next_users_url(body))
+
+    def _on_done(_):
+        if not next_url.done():
+            next_url.set_result(None)
+
+    page = asyncio.ensure_future(fetch_extracted_async(
+        url, extract, 'mc_user', on_fetched=_on_fetched))
+    page.add_done_callback(_on_done)
+    return page, next_url
+
+
+async def _get_user_reviews_from_page(page, next_url, max_pages=None,
+                                      known_keys=None):
+    """Returns the user reviews of the given user reviews page task, started
+    by _fetch_users_page, and of all pages following it, up to max_pages pages
+    in total.
+
+    Pages are walked iteratively; the next page is fetched as soon as its
+    link is found, while the current page is extracted through the page
+    cache. If the keys of known reviews are given, only unknown reviews are
+    returned, and the walk stops at the first page holding no unknown
+    reviews."""
+    user_reviews = []
+    page_count = 1
+    current = None
+    try:
+        while page is not None:
+            url = await next_url
+            current, page = page, None
+            if url is not None and (
+                    max_pages is None or page_count < max_pages):
+                page, next_url = _fetch_users_page(url)
+            page_reviews = (await current)['user_reviews']
+            if known_keys is not None:
+                new_reviews = [review for review in page_reviews
+                               if _user_review_key(review) not in known_keys]
+                if page_reviews and not new_reviews:
+                    break
+                page_reviews = new_reviews
+            user_reviews += page_reviews
+            # print("Extracted {} reviews.".format(len(user_reviews)))
+            page_count += 1
+    finally:
+        for task in (current, page):
+            if task is not None:
+                task.cancel()
     return user_reviews
 
 
 USERS_REVIEWS_URL_SUFFIX = "/user-reviews?page=0"
+USERS_REVIEWS_BY_DATE_URL_SUFFIX = "/user-reviews?sort-by=date&page=0"
 USER_SCORE_CLASSES = [
     "metascore_w user larger movie positive",
     "metascore_w user larger movie mixed",
     "metascore_w user larger movie negative"
 ]
 
-def _get_user_reviews_props(movie_url):
-    users_url = movie_url + USERS_REVIEWS_URL_SUFFIX
-    users_request = urllib.request.Request(users_url, headers=_HEADERS)
-    users_page = bs(urllib.request.urlopen(users_request), "html.parser")
-    users_props = {}
+_USERS_SUMMARY_PROPS = [
+    'movie_name', 'avg_user_score', 'positive_rating_frequency',
+    'mixed_rating_frequency', 'negative_rating_frequency']
+
+def _extract_users_first_page(users_page):
+    users_props = _extract_users_page(users_page)
     users_props['movie_name'] = users_page.find_all(
         "meta", {"property": "og:title"})[0]['content']
     user_score = float(users_page.find_all(
@@ -180,25 +379,154 @@ def _get_user_reviews_props(movie_url):
     for rating in ['positive', 'mixed', 'negative']:
         users_props['{}_rating_frequency'.format(
             rating)] = _get_user_rating_freq(users_page, rating)
-    users_props['user_reviews'] = _get_user_reviews_from_page(users_page)
+    return users_props
+
+
+async def _get_user_reviews_props(movie_url, max_pages=None,
+                                  known_reviews=None):
+    """Returns the user reviews properties of the given movie. If known
+    reviews are given, user reviews are walked newest first only until
+    reaching a page of known reviews, and the new ones are appended to the
+    known ones."""
+    known_keys = None
+    users_url = movie_url + USERS_REVIEWS_URL_SUFFIX
+    if known_reviews is not None:
+        known_keys = set(_user_review_key(review) for review in known_reviews)
+        users_url = movie_url + USERS_REVIEWS_BY_DATE_URL_SUFFIX
+    first_page, next_url = _fetch_users_page(
+        users_url, _extract_users_first_page)
+    user_reviews = await _get_user_reviews_from_page(
+        first_page, next_url, max_pages, known_keys)
+    page_props = first_page.result()
+    users_props = {key: page_props[key] for key in _USERS_SUMMARY_PROPS}
+    users_props['user_reviews'] = user_reviews
+    if known_reviews is not None:
+        users_props['user_reviews'] = \
+            list(known_reviews) + users_props['user_reviews']
     return users_props
 
 
 # === metacritic crawling ===
 
-def get_metacritic_movie_properties(movie_name, year=None):
+def _get_max_user_review_pages():
+    return _get_cfg().get(_CfgKey.MAX_USER_REVIEW_PAGES)
+
+
+async def _resolved_props(props, movie_url):  # pylint: disable=W0613
+    return props
+
+
+async def _get_movie_props_async(movie_name, year, subpages,
+                                 max_user_review_pages=None, on_done=None):
+    """Concurrently crawls the given sub-pages of the given movie. If any of
+    them fails, a SubPagesError holding the properties extracted from the
+    rest is raised. If given, on_done is called with the name and properties
+    of each sub-page once crawled."""
+    if max_user_review_pages is None:
+        max_user_review_pages = _get_max_user_review_pages()
+    movie_url, critics_props = await _resolve_movie_url(movie_name, year)
+    getters = collections.OrderedDict([
+        ('critics', _get_critics_reviews_props),
+        ('users', functools.partial(
+            _get_user_reviews_props, max_pages=max_user_review_pages)),
+    ])
+    if critics_props is not None:
+        # the critics page was already fetched to resolve the movie URL
+        getters['critics'] = functools.partial(
+            _resolved_props, critics_props)
+    return await _gather_subpages(
+        collections.OrderedDict((subpage, getters[subpage])
+                                for subpage in subpages),
+        movie_url, on_done=on_done)
+
+
+async def get_metacritic_movie_properties_async(
+        movie_name, year=None, max_user_review_pages=None, fields=None):
+    """Extracts the properties of a movie profile from Metacritic.
+
+    At most max_user_review_pages pages of user reviews are crawled; if not
+    given, the max_user_review_pages configuration key is used, and if that
+    is not set all pages are crawled. If property names are given, named as
+    in the returned properties, only the pages producing them are crawled;
+    unknown names raise a ValueError."""
+    return await _get_movie_props_async(
+        movie_name, year, _subpages_for(fields, prefix='mc_'),
+        max_user_review_pages)
+
+
+async def _get_capped_user_reviews_props(movie_url, known_reviews=None):
+    return await _get_user_reviews_props(
+        movie_url, _get_max_user_review_pages(), known_reviews)
+
+
+_SUBPAGES = collections.OrderedDict([
+    ('critics', _get_critics_reviews_props),
+    ('users', _get_capped_user_reviews_props),
+])
+
+# the profile fields each sub-page produces
+_FIELDS = collections.OrderedDict([
+    ('critics', ('mc_metascore', 'mc_pro_critic_reviews')),
+    ('users', (
+        'mc_movie_name', 'mc_avg_user_score', 'mc_positive_rating_frequency',
+        'mc_mixed_rating_frequency', 'mc_negative_rating_frequency',
+        'mc_user_reviews')),
+])
+FIELDS = [field for fields in _FIELDS.values() for field in fields]
+
+def _subpages_for(fields=None, prefix=''):
+    return _subpages_for_fields(_FIELDS, fields, prefix)
+
+
+def _to_profile_props(props):
+    return {'mc_'+key: props[key] for key in props}
+
+
+async def crawl_subpages_async(movie_name, year, subpages, profile=None):
+    """Crawls only the given Metacritic sub-pages of the given movie,
+    returning the profile properties extracted from them.
+
+    If the existing profile of the movie is given, reviews already in it are
+    kept, and only new reviews are added to them."""
+    movie_url, _ = await _resolve_movie_url(movie_name, year)
+    getters = collections.OrderedDict(
+        (subpage, _SUBPAGES[subpage]) for subpage in subpages)
+    profile = profile or {}
+    if 'critics' in getters and profile.get('mc_pro_critic_reviews'):
+        getters['critics'] = functools.partial(
+            _get_new_critics_reviews_props,
+            known_reviews=profile['mc_pro_critic_reviews'])
+    if 'users' in getters and profile.get('mc_user_reviews'):
+        getters['users'] = functools.partial(
+            _get_capped_user_reviews_props,
+            known_reviews=profile['mc_user_reviews'])
+    try:
+        props = await _gather_subpages(getters, movie_url)
+    except SubPagesError as exc:
+        exc.props = _to_profile_props(exc.props)
+        raise
+    return _to_profile_props(props)
+
+
+def get_metacritic_movie_properties(movie_name, year=None,
+                                    max_user_review_pages=None, fields=None):
     """Extracts the properties of a movie profile from Metacritic."""
-    movie_url = _get_movie_url_by_name(movie_name, year)
-    # print(movie_url)
-    movie_props = {}
-    movie_props.update(_get_critics_reviews_props(movie_url))
-    movie_props.update(_get_user_reviews_props(movie_url))
-    return movie_props
+    return run_sync(get_metacritic_movie_properties_async(
+        movie_name, year, max_user_review_pages, fields))
 
 
-def crawl_by_title(movie_name, verbose, year=None,
-                   parent_pbar=None):
-    """Extracts a movie profile from Metacritic and saves it to disk."""
+# profiles are dumped with these keyword arguments
+_DUMP_KWARGS = {'indent': 2, 'sort_keys': True}
+
+# profiles missing some sub-pages are marked with them under this key
+_MISSING_KEY = 'mc_missing_subpages'
+
+_FAILURES = _FailureLog('metacritic')
+
+async def crawl_by_title_async(movie_name, verbose, year=None,
+                               parent_pbar=None, force=False):
+    """Extracts a movie profile from Metacritic and saves it to disk. Titles
+    that failed recently are skipped, unless forced."""
     def _print(msg):
         if verbose:
             if parent_pbar is not None:
@@ -211,37 +539,81 @@ def crawl_by_title(movie_name, verbose, year=None,
     os.makedirs(METACRITIC_DIR_PATH, exist_ok=True)
     file_name = _parse_name_for_file_name(movie_name) + ".json"
     file_path = os.path.join(METACRITIC_DIR_PATH, file_name)
-    if os.path.isfile(file_path):
-        _print('{} already processed'.format(movie_name))
+    subpages = _subpages_for()
+    if not subpages:
+        _print('No Metacritic fields selected for {}'.format(movie_name))
         return _result.EXIST
+    if os.path.isfile(file_path) and not is_replay_mode():
+        # partial profiles are completed with the sub-pages they miss
+        subpages = _missing_subpages(file_path, _MISSING_KEY, subpages)
+        if not subpages:
+            _print('{} already processed'.format(movie_name))
+            return _result.EXIST
+    if not is_replay_mode() and not force:
+        reason = _FAILURES.recent_failure(movie_name, year)
+        if reason is not None:
+            _print('{} failed recently ({})'.format(movie_name, reason))
+            return _result.KNOWN_FAILURE
+
+    def _checkpoint(subpage, props):
+        # each sub-page is saved once crawled, so retries crawl only the rest
+        _save_profile(
+            file_path, _to_profile_props(props), _MISSING_KEY, _SUBPAGES,
+            [subpage], **_DUMP_KWARGS)
+        _record_fetch_times(
+            'metacritic', file_name, movie_name, year, [subpage])
+
     try:
-        props = get_metacritic_movie_properties(movie_name, year)
-        props = {'mc_'+key: props[key] for key in props}
-        with open(file_path, 'w+') as json_file:
-            json.dump(props, json_file, indent=2, sort_keys=True)
+        await _with_deadline(
+            _get_movie_props_async(
+                movie_name, year, subpages, on_done=_checkpoint),
+            _get_movie_deadline())
+        _FAILURES.clear(movie_name, year)
         _print("Done saving a profile for {}.".format(movie_name))
         return _result.SUCCESS
+    except DeadlineExceededError as exc:
+        _FAILURES.record(movie_name, year, exc)
+        _print("Extracting a profile for {} timed out".format(movie_name))
+        return _result.TIMEOUT
+    except SubPagesError as exc:
+        _FAILURES.record(movie_name, year, exc)
+        _print("Extracting a profile for {} failed on {}".format(
+            movie_name, ', '.join(exc.errors)))
+        return _result.FAILURE
     except Exception as exc:
-        _print("Extracting a profile for {} failed".format(movie_name))
+        reason = _FAILURES.record(movie_name, year, exc)
+        _print("Extracting a profile for {} failed ({})".format(
+            movie_name, reason))
         # traceback.print_exc()
         return _result.FAILURE
         # print("Extracting a profile for {} failed with:".format(movie_name))
         # raise exc
 
 
-def crawl_by_file(file_path, verbose, year=None):
+def crawl_by_title(movie_name, verbose, year=None,
+                   parent_pbar=None):
+    """Extracts a movie profile from Metacritic and saves it to disk."""
+    return run_sync(crawl_by_title_async(
+        movie_name, verbose, year, parent_pbar))
+
+
+def crawl_by_file(file_path, verbose, year=None, workers=1):
     """Crawls Metacritics, building movie profiles for a movies in the given
-    file."""
-    results = {res_type : 0 for res_type in _result.ALL_TYPES}
+    file. Up to workers titles are crawled concurrently."""
+    if not _subpages_for():
+        print("No Metacritic profile fields selected; skipping Metacritic.")
+        return
     titles = _titles_from_file(file_path)
     if verbose:
         print("Crawling over all {} Metacritic movies in {}...".format(
             len(titles), file_path))
-    movie_pbar = tqdm(titles, miniters=1, maxinterval=0.0001,
-                      mininterval=0.00000000001, total=len(titles))
-    for title in movie_pbar:
-        res = crawl_by_title(title, verbose, year, movie_pbar)
-        results[res] += 1
-    print("{} Metacritic movie profiles crawled.")
+    with _journaled(_file_job_name('metacritic_byfile', file_path)):
+        results = _crawl_titles(
+            crawl_by_title_async, titles, verbose, year, workers,
+            source='metacritic')
+    print("{} Metacritic movie profiles crawled.".format(
+        sum(results.values())))
     for res_type in _result.ALL_TYPES:
         print('{} {}.'.format(results[res_type], res_type))
+    if verbose and bandwidth_stats():
+        print_bandwidth_stats()
@@ -0,0 +1,232 @@
+"""A content-addressed on-disk cache of raw fetched pages.
+
+Every fetch of a page is recorded in an index keyed by url and fetch time,
+together with the HTTP validators (ETag and Last-Modified) it was served
+with, while page contents are stored once per distinct content hash,
+compressed, under the blobs sub-directory. Properties extracted from a page
+can be stored alongside its contents, so that pages found unchanged on
+re-crawls need not be parsed again. When the total size of stored contents
+exceeds the configured bound, the least recently used contents are evicted
+together with the fetches and extractions pointing to them."""
+
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+import morejson as json
+
+from holcrawl.shared import (
+    _get_cfg,
+    _CfgKey,
+    _get_page_cache_dir_path
+)
+
+
+DEFAULT_MAX_SIZE_MB = 2048
+_EVICTION_TARGET = 0.9
+_EVICTION_BATCH = 100
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS blobs ("
+    " hash TEXT PRIMARY KEY, size INTEGER, last_used REAL)",
+    "CREATE TABLE IF NOT EXISTS fetches ("
+    " url TEXT, fetched_at REAL, hash TEXT, etag TEXT, last_modified TEXT)",
+    "CREATE TABLE IF NOT EXISTS extractions ("
+    " hash TEXT, extractor TEXT, props TEXT, PRIMARY KEY (hash, extractor))",
+    "CREATE INDEX IF NOT EXISTS fetches_by_url ON fetches (url, fetched_at)",
+    "CREATE INDEX IF NOT EXISTS fetches_by_hash ON fetches (hash)",
+    "CREATE INDEX IF NOT EXISTS blobs_by_use ON blobs (last_used)",
+]
+_VALIDATOR_COLUMNS = ['etag', 'last_modified']
+
+
+class PageCache(object):
+    """An on-disk cache of raw pages, bounded to max_size bytes of stored
+    contents. Safe to use from multiple threads."""
+
+    def __init__(self, dir_path, max_size):
+        self.dir_path = dir_path
+        self.max_size = max_size
+        os.makedirs(os.path.join(dir_path, 'blobs'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(dir_path, 'index.db'), check_same_thread=False)
+        with self._db:
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+            self._add_validator_columns()
+        self.size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _add_validator_columns(self):
+        # caches created before validators were stored lack these columns
+        columns = [
+            row[1] for row in self._db.execute("PRAGMA table_info(fetches)")]
+        for column in _VALIDATOR_COLUMNS:
+            if column not in columns:
+                self._db.execute(
+                    "ALTER TABLE fetches ADD COLUMN {} TEXT".format(column))
+
+    def _blob_path(self, content_hash):
+        return os.path.join(
+            self.dir_path, 'blobs', content_hash[:2], content_hash)
+
+    def _write_blob(self, content_hash, body):
+        blob_path = self._blob_path(content_hash)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        compressed = zlib.compress(body)
+        with open(blob_path, 'wb') as blob_file:
+            blob_file.write(compressed)
+        return len(compressed)
+
+    def _read_blob(self, content_hash):
+        with open(self._blob_path(content_hash), 'rb') as blob_file:
+            return zlib.decompress(blob_file.read())
+
+    def store(self, url, body, fetched_at=None, etag=None,
+              last_modified=None):
+        """Records a fetch of the given url, returning the hash of the page
+        contents."""
+        fetched_at = fetched_at or time.time()
+        content_hash = hashlib.sha256(body).hexdigest()
+        with self._lock, self._db:
+            known = self._db.execute(
+                "SELECT 1 FROM blobs WHERE hash = ?",
+                (content_hash,)).fetchone()
+            if known:
+                self._db.execute(
+                    "UPDATE blobs SET last_used = ? WHERE hash = ?",
+                    (fetched_at, content_hash))
+            else:
+                size = self._write_blob(content_hash, body)
+                self._db.execute(
+                    "INSERT INTO blobs VALUES (?, ?, ?)",
+                    (content_hash, size, fetched_at))
+                self.size += size
+            self._db.execute(
+                "INSERT INTO fetches (url, fetched_at, hash, etag, "
+                "last_modified) VALUES (?, ?, ?, ?, ?)",
+                (url, fetched_at, content_hash, etag, last_modified))
+            if self.size > self.max_size:
+                self._evict()
+        return content_hash
+
+    def _evict(self):
+        target = self.max_size * _EVICTION_TARGET
+        while self.size > target:
+            victims = self._db.execute(
+                "SELECT hash, size FROM blobs ORDER BY last_used LIMIT ?",
+                (_EVICTION_BATCH,)).fetchall()
+            if not victims:
+                self.size = 0
+                return
+            for content_hash, size in victims:
+                try:
+                    os.remove(self._blob_path(content_hash))
+                except FileNotFoundError:
+                    pass
+                self._db.execute(
+                    "DELETE FROM fetches WHERE hash = ?", (content_hash,))
+                self._db.execute(
+                    "DELETE FROM extractions WHERE hash = ?", (content_hash,))
+                self._db.execute(
+                    "DELETE FROM blobs WHERE hash = ?", (content_hash,))
+                self.size -= size
+                if self.size <= target:
+                    return
+
+    def latest(self, url):
+        """Returns the contents and fetch time of the latest cached fetch of
+        the given url, or None if it was never cached."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT hash, fetched_at FROM fetches WHERE url = ? "
+                "ORDER BY fetched_at DESC LIMIT 1", (url,)).fetchone()
+            if row is None:
+                return None
+            content_hash, fetched_at = row
+            try:
+                body = self._read_blob(content_hash)
+            except FileNotFoundError:
+                return None
+            with self._db:
+                self._db.execute(
+                    "UPDATE blobs SET last_used = ? WHERE hash = ?",
+                    (time.time(), content_hash))
+            return body, fetched_at
+
+    def validators(self, url):
+        """Returns a (content hash, etag, last modified) tuple for the latest
+        cached fetch of the given url, or None if it was never cached."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT hash, etag, last_modified FROM fetches WHERE url = ? "
+                "ORDER BY fetched_at DESC LIMIT 1", (url,)).fetchone()
+
+    def revalidated(self, url, content_hash, fetched_at=None):
+        """Records a fetch of the given url that found its latest cached
+        contents unchanged, returning those contents."""
+        fetched_at = fetched_at or time.time()
+        with self._lock:
+            try:
+                body = self._read_blob(content_hash)
+            except FileNotFoundError:
+                return None
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO fetches (url, fetched_at, hash, etag, "
+                    "last_modified) SELECT url, ?, hash, etag, last_modified "
+                    "FROM fetches WHERE url = ? AND hash = ? "
+                    "ORDER BY fetched_at DESC LIMIT 1",
+                    (fetched_at, url, content_hash))
+                self._db.execute(
+                    "UPDATE blobs SET last_used = ? WHERE hash = ?",
+                    (fetched_at, content_hash))
+            return body
+
+    def extraction(self, content_hash, extractor):
+        """Returns the properties the given extractor produced from the given
+        contents, or None if none were stored."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT props FROM extractions WHERE hash = ? AND "
+                "extractor = ?", (content_hash, extractor)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def store_extraction(self, content_hash, extractor, props):
+        """Stores the properties the given extractor produced from the given
+        contents."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?)",
+                (content_hash, extractor, json.dumps(props)))
+
+    def history(self, url):
+        """Returns a list of (fetch time, content hash) tuples for all cached
+        fetches of the given url, oldest first."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT fetched_at, hash FROM fetches WHERE url = ? "
+                "ORDER BY fetched_at", (url,)).fetchall()
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_page_cache():
+    """Returns the page cache of the data directory, or None if page caching
+    is disabled in the configuration."""
+    global _CACHE  # pylint: disable=W0603
+    cfg = _get_cfg()
+    if not cfg.get(_CfgKey.PAGE_CACHE, True):
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            max_size_mb = cfg.get(
+                _CfgKey.PAGE_CACHE_MAX_MB, DEFAULT_MAX_SIZE_MB)
+            _CACHE = PageCache(
+                _get_page_cache_dir_path(), max_size_mb * 1024 * 1024)
+        return _CACHE
@@ -0,0 +1,218 @@
+"""Per-host rate limiting with adaptive concurrency for holcrawl fetches.
+
+Every request to a host first waits for a concurrency slot and then for a
+token from the host's token bucket. The number of concurrency slots adapts
+in an AIMD fashion: it grows additively (by about one per window of
+requests) while responses are fast and successful, and is cut
+multiplicatively on 429/503 responses and timeouts. Limiters are only ever
+used from within the crawling event loop."""
+
+import asyncio
+import collections
+
+from holcrawl.shared import (
+    _get_cfg,
+    _CfgKey
+)
+
+
+# === configuration ===
+
+DEFAULT_HOST_LIMITS = {
+    'imdb.com': {'rate': 5, 'max_concurrency': 10},
+    'metacritic.com': {'rate': 2, 'max_concurrency': 4},
+    'en.wikipedia.org': {'rate': 5, 'max_concurrency': 4},
+}
+DEFAULT_LIMITS = {'rate': 5, 'max_concurrency': 8}
+
+_HOST_LIMITS = {}
+
+def set_host_limits(host, rate=None, max_concurrency=None, burst=None):
+    """Sets the requests per second, maximal concurrency and burst size
+    allowed for the given host (and all of its sub-domains)."""
+    limits = _HOST_LIMITS.setdefault(host, {})
+    for key, val in [('rate', rate), ('max_concurrency', max_concurrency),
+                     ('burst', burst)]:
+        if val is not None:
+            limits[key] = val
+    _LIMITERS.pop(host, None)
+
+
+def _host_key(hostname):
+    """Returns the configured host a hostname falls under."""
+    known = set(DEFAULT_HOST_LIMITS) | set(_HOST_LIMITS) | set(
+        _get_cfg().get(_CfgKey.HOST_LIMITS, {}))
+    for host in sorted(known, key=len, reverse=True):
+        if hostname == host or hostname.endswith('.' + host):
+            return host
+    return hostname
+
+
+def _get_limits(host):
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(DEFAULT_HOST_LIMITS.get(host, {}))
+    limits.update(_get_cfg().get(_CfgKey.HOST_LIMITS, {}).get(host, {}))
+    limits.update(_HOST_LIMITS.get(host, {}))
+    return limits
+
+
+# === limiting ===
+
+_BACKOFF_STATUSES = (429, 503)
+_DECREASE_FACTOR = 0.5
+_LATENCY_TOLERANCE = 2.0
+_LATENCY_EWMA_WEIGHT = 0.1
+
+class _HostLimiter(object):
+    """A token bucket and an AIMD concurrency limit for a single host."""
+
+    def __init__(self, rate, max_concurrency, burst=None, min_concurrency=1):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(min(2, max_concurrency))
+        self.in_flight = 0
+        self.latency = None
+        self._tokens = self.burst
+        self._last_refill = None
+        self._last_decrease = None
+        self._waiters = collections.deque()
+
+    # --- token bucket ---
+
+    async def _take_token(self):
+        now = asyncio.get_event_loop().time()
+        if self._last_refill is not None:
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        # tokens may go negative; each caller then waits for its own token
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+    def can_send_now(self):
+        """Returns True if a request could be sent right away without
+        exceeding the rate and concurrency budgets of the host."""
+        if self.in_flight >= int(self.concurrency):
+            return False
+        tokens = self._tokens
+        if self._last_refill is not None:
+            now = asyncio.get_event_loop().time()
+            tokens = min(
+                self.burst, tokens + (now - self._last_refill) * self.rate)
+        return tokens >= 1
+
+    # --- concurrency slots ---
+
+    def _wake_next(self):
+        while self._waiters and self.in_flight < int(self.concurrency):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def acquire(self):
+        """Waits for a concurrency slot and a token to send a request."""
+        while self.in_flight >= int(self.concurrency):
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next()
+                raise
+        self.in_flight += 1
+        try:
+            await self._take_token()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake_next()
+
+    # --- adaptation ---
+
+    def _increase(self):
+        if self.concurrency < self.max_concurrency:
+            self.concurrency = min(
+                self.max_concurrency,
+                self.concurrency + 1.0 / self.concurrency)
+            self._wake_next()
+
+    def _decrease(self):
+        now = asyncio.get_event_loop().time()
+        # a burst of failures from the same window counts as one signal
+        window = self.latency or 1.0
+        if self._last_decrease is not None and \
+                now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.concurrency = max(
+            self.min_concurrency, self.concurrency * _DECREASE_FACTOR)
+
+    def record(self, latency=None, status=None, timed_out=False,
+               failed=False):
+        """Adapts the concurrency limit to the outcome of a request."""
+        if timed_out or status in _BACKOFF_STATUSES:
+            self._decrease()
+            return
+        if failed or (status is not None and status >= 500):
+            return
+        if latency is None:
+            return
+        healthy = self.latency is None or \
+            latency <= _LATENCY_TOLERANCE * self.latency
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += _LATENCY_EWMA_WEIGHT * (latency - self.latency)
+        if healthy:
+            self._increase()
+
+    def slot(self):
+        """Returns an async context manager holding a request slot; set its
+        status attribute to the response status before leaving it."""
+        return _Slot(self)
+
+
+class _Slot(object):
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.status = None
+        self._start = None
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self._start = asyncio.get_event_loop().time()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        latency = asyncio.get_event_loop().time() - self._start
+        self.limiter.release()
+        if exc_type is None:
+            self.limiter.record(latency=latency, status=self.status)
+        elif issubclass(exc_type, asyncio.TimeoutError):
+            self.limiter.record(timed_out=True)
+        elif issubclass(exc_type, Exception):
+            self.limiter.record(failed=True)
+        return False
+
+
+_LIMITERS = {}
+
+def get_host_limiter(hostname):
+    """Returns the rate limiter in charge of the given hostname."""
+    host = _host_key(hostname)
+    if host not in _LIMITERS:
+        limits = _get_limits(host)
+        _LIMITERS[host] = _HostLimiter(
+            rate=limits['rate'], max_concurrency=limits['max_concurrency'],
+            burst=limits.get('burst'))
+    return _LIMITERS[host]
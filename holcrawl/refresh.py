@@ -0,0 +1,240 @@
+"""Refreshes stale parts of existing movie profiles.
+
+The time each sub-page of a profile was last fetched is recorded when the
+profile is crawled. Each sub-page has a time-to-live, short for pages that
+change daily (like ratings and reviews) and long for pages that hardly ever
+change (like release dates and box office figures). Refreshing re-crawls
+only the sub-pages whose time-to-live expired, most stale and most recently
+released movies first, and merges what they yield into the existing
+profiles."""
+
+import os
+import sys
+import time
+import asyncio
+import collections
+from datetime import datetime
+
+from tqdm import tqdm
+
+from holcrawl import imdb_crawl
+from holcrawl import metacritic_crawl
+from holcrawl.engine import run_sync
+from holcrawl.shared import (
+    _get_cfg,
+    _CfgKey,
+    _get_imdb_dir_path,
+    _get_metacritic_dir_path,
+    _read_fetch_times,
+    _record_fetch_times,
+    _load_profile,
+    _save_profile,
+    _with_deadline,
+    _get_movie_deadline,
+    _result,
+    SubPagesError,
+    DeadlineExceededError
+)
+
+
+# the number of hours after which each sub-page of a profile is stale
+DEFAULT_TTLS = {
+    'imdb': {
+        'profile': 24,
+        'ratings': 24,
+        'reviews': 24,
+        'business': 30 * 24,
+        'release': 30 * 24,
+    },
+    'metacritic': {
+        'critics': 7 * 24,
+        'users': 24,
+    },
+}
+
+_Source = collections.namedtuple('_Source', ['crawler', 'dir_path'])
+
+_SOURCES = collections.OrderedDict([
+    ('imdb', _Source(imdb_crawl, _get_imdb_dir_path)),
+    ('metacritic', _Source(metacritic_crawl, _get_metacritic_dir_path)),
+])
+SOURCES = list(_SOURCES)
+
+
+def _get_ttl(source, subpage):
+    ttls = dict(DEFAULT_TTLS[source])
+    ttls.update(_get_cfg().get(_CfgKey.REFRESH_TTLS, {}).get(source, {}))
+    return ttls[subpage] * 60 * 60
+
+
+# === scheduling ===
+
+_RefreshTask = collections.namedtuple(
+    '_RefreshTask',
+    ['priority', 'source', 'file_name', 'title', 'year', 'subpages'])
+
+
+def _profile_states(source):
+    """Yields a (file name, fetch times, release year) tuple for every profile
+    of the given source. Profiles crawled before fetch times were recorded
+    are taken to have had all pages they do not miss fetched when their file
+    was last written."""
+    dir_path = _SOURCES[source].dir_path()
+    if not os.path.exists(dir_path):
+        return
+    subpages = list(_SOURCES[source].crawler._SUBPAGES)
+    for file_name in sorted(os.listdir(dir_path)):
+        if os.path.splitext(file_name)[1] != '.json':
+            continue
+        try:
+            profile = _load_profile(os.path.join(dir_path, file_name))
+        except ValueError:
+            continue
+        times = _read_fetch_times(source, file_name)
+        if times is None:
+            times = _legacy_fetch_times(
+                os.path.join(dir_path, file_name), profile, subpages,
+                _SOURCES[source].crawler._MISSING_KEY)
+            if times is None:
+                continue
+        yield file_name, times, _release_year(profile, times)
+
+
+def _legacy_fetch_times(file_path, profile, subpages, missing_key):
+    # only IMDB profiles hold the title they were crawled by
+    if 'name' not in profile:
+        return None
+    fetched_at = os.path.getmtime(file_path)
+    return {'title': profile['name'], 'year': profile.get('year'),
+            'fetched_at': {subpage: fetched_at for subpage in subpages
+                           if subpage not in profile.get(missing_key, [])}}
+
+
+def _release_year(profile, times):
+    # only IMDB profiles hold a release year; others fall back to the year
+    # they were crawled by, if any
+    return profile.get('year') or profile.get('release_year') or \
+        times['year']
+
+
+def _recency_boost(year, now):
+    # a movie from this year counts twice as urgent as a very old one
+    if year is None:
+        return 1.0
+    age = max(0, datetime.fromtimestamp(now).year - int(year))
+    return 1.0 + 1.0 / (1 + age)
+
+
+def schedule(sources=None, now=None):
+    """Returns a list of refresh tasks for all profiles of the given sources
+    (all by default) with stale sub-pages, most urgent first. Only sub-pages
+    producing the profile fields selected with set_fields are refreshed."""
+    now = now or time.time()
+    tasks = []
+    for source in sources or SOURCES:
+        subpages = _SOURCES[source].crawler._subpages_for()
+        if not subpages:
+            continue
+        for file_name, times, release_year in _profile_states(source):
+            staleness = {}
+            for subpage in subpages:
+                # pages never fetched are left for crawls to complete
+                if subpage not in times['fetched_at']:
+                    continue
+                age = now - times['fetched_at'][subpage]
+                ttl = _get_ttl(source, subpage)
+                if age >= ttl:
+                    staleness[subpage] = age / ttl
+            if not staleness:
+                continue
+            priority = max(staleness.values()) * _recency_boost(
+                release_year, now)
+            tasks.append(_RefreshTask(
+                priority, source, file_name, times['title'], times['year'],
+                sorted(staleness)))
+    tasks.sort(key=lambda task: task.priority, reverse=True)
+    return tasks
+
+
+# === refreshing ===
+
+def _profile_path(source, file_name):
+    return os.path.join(_SOURCES[source].dir_path(), file_name)
+
+
+async def _refresh_async(task, verbose, pbar):
+    def _print(msg):
+        if verbose:
+            pbar.set_description(msg)
+            pbar.refresh()
+            sys.stdout.flush()
+
+    crawler = _SOURCES[task.source].crawler
+    try:
+        # the existing profile lets crawlers fetch only what is new
+        profile = _load_profile(_profile_path(task.source, task.file_name))
+        props = await _with_deadline(
+            crawler.crawl_subpages_async(
+                task.title, task.year, task.subpages, profile),
+            _get_movie_deadline())
+        refreshed = task.subpages
+        result = _result.SUCCESS
+    except SubPagesError as exc:
+        props = exc.props
+        refreshed = [sub for sub in task.subpages if sub not in exc.errors]
+        result = _result.FAILURE
+    except DeadlineExceededError:
+        _print("Refreshing {} timed out".format(task.title))
+        return _result.TIMEOUT
+    except Exception:  # pylint: disable=W0703
+        _print("Refreshing {} failed".format(task.title))
+        return _result.FAILURE
+    if refreshed:
+        _save_profile(
+            _profile_path(task.source, task.file_name), props,
+            crawler._MISSING_KEY, list(crawler._SUBPAGES), refreshed,
+            **crawler._DUMP_KWARGS)
+        _record_fetch_times(
+            task.source, task.file_name, task.title, task.year, refreshed)
+    _print("Refreshed {} of {}".format(', '.join(refreshed), task.title))
+    return result
+
+
+async def _refresh_all_async(tasks, verbose, workers, pbar):
+    results = {res_type : 0 for res_type in _result.ALL_TYPES}
+    semaphore = asyncio.Semaphore(max(1, workers))
+
+    async def _refresh(task):
+        async with semaphore:
+            return await _refresh_async(task, verbose, pbar)
+
+    # tasks are created in order, so the most urgent are refreshed first
+    futures = [asyncio.ensure_future(_refresh(task)) for task in tasks]
+    for next_done in asyncio.as_completed(futures):
+        results[await next_done] += 1
+        pbar.update(1)
+    return results
+
+
+def refresh(verbose, sources=None, workers=1, limit=None, dry_run=False):
+    """Re-crawls the stale sub-pages of existing profiles of the given
+    sources (all by default), refreshing at most limit profiles, most urgent
+    first, with up to workers profiles refreshed concurrently."""
+    tasks = schedule(sources)
+    if limit is not None:
+        tasks = tasks[:limit]
+    if dry_run:
+        for task in tasks:
+            print("{:.2f} {} {}: {}".format(
+                task.priority, task.source, task.title,
+                ', '.join(task.subpages)))
+        return
+    if verbose:
+        print("Refreshing {} stale profiles...".format(len(tasks)))
+    pbar = tqdm(total=len(tasks), miniters=1, maxinterval=0.0001,
+                mininterval=0.00000000001, disable=not verbose)
+    results = run_sync(_refresh_all_async(tasks, verbose, workers, pbar))
+    pbar.close()
+    print("{} movie profiles refreshed.".format(len(tasks)))
+    for res_type in [_result.SUCCESS, _result.FAILURE, _result.TIMEOUT]:
+        print('{} {}.'.format(results[res_type], res_type))
@@ -0,0 +1,193 @@
+"""Retries with jittered backoff and per-host circuit breaking for fetches.
+
+Failed requests that may succeed when repeated (timeouts, connection errors
+and 429/5xx responses) are retried after a randomized, exponentially growing
+delay, or after the delay asked for by a Retry-After header. Each host also
+has a circuit breaker: once most recent requests to a host fail, the
+breaker opens and all requests to that host wait until a cool-down period
+passes; a single probe request is then let through, and the breaker closes
+if it succeeds or opens again, for twice as long, if it fails. Breakers are
+only ever used from within the crawling event loop."""
+
+import time
+import random
+import asyncio
+import collections
+import http.client
+import email.utils
+from urllib.error import HTTPError
+
+from holcrawl.rate_limit import _host_key
+from holcrawl.shared import (
+    _get_cfg,
+    _CfgKey
+)
+
+
+# === configuration ===
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_DELAY = 1
+DEFAULT_MAX_DELAY = 60
+DEFAULT_BREAKER_COOLDOWN = 30
+_MAX_RETRY_AFTER = 600
+_MAX_BREAKER_COOLDOWN = 600
+
+def _get_retry_cfg():
+    cfg = _get_cfg()
+    return (cfg.get(_CfgKey.MAX_RETRIES, DEFAULT_MAX_RETRIES),
+            cfg.get(_CfgKey.RETRY_BASE_DELAY, DEFAULT_BASE_DELAY),
+            cfg.get(_CfgKey.RETRY_MAX_DELAY, DEFAULT_MAX_DELAY))
+
+
+# === retries ===
+
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+_RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    asyncio.IncompleteReadError,
+    http.client.HTTPException,
+    ConnectionError,
+)
+
+def _is_retryable(exc):
+    if isinstance(exc, HTTPError):
+        return exc.code in _RETRYABLE_STATUSES
+    return isinstance(exc, _RETRYABLE_ERRORS)
+
+
+def _retry_after(exc):
+    """Returns the number of seconds a Retry-After header of the given error
+    asks to wait, or None if there is none."""
+    if not isinstance(exc, HTTPError) or exc.headers is None:
+        return None
+    value = exc.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = email.utils.parsedate_to_datetime(
+                value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0, delay), _MAX_RETRY_AFTER)
+
+
+def _backoff_delay(attempt, base_delay, max_delay, exc):
+    # "full jitter": a uniformly random delay up to the exponential bound
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    retry_after = _retry_after(exc)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+async def with_retries(hostname, request):
+    """Awaits request(), a coroutine function making a request to the given
+    host, retrying it on transient failures while respecting the circuit
+    breaker of the host."""
+    max_retries, base_delay, max_delay = _get_retry_cfg()
+    breaker = get_host_breaker(hostname)
+    attempt = 0
+    while True:
+        probe = await breaker.wait()
+        try:
+            result = await request()
+        except Exception as exc:
+            if not _is_retryable(exc):
+                breaker.record(True, probe)
+                raise
+            breaker.record(False, probe)
+            if attempt >= max_retries:
+                raise
+            delay = _backoff_delay(attempt, base_delay, max_delay, exc)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            breaker.record_aborted(probe)
+            raise
+        breaker.record(True, probe)
+        return result
+
+
+# === circuit breaking ===
+
+class _CircuitBreaker(object):
+    """A circuit breaker for requests to a single host."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    WINDOW = 20
+    MIN_OUTCOMES = 10
+    FAILURE_RATIO = 0.5
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, cooldown):
+        self.state = self.CLOSED
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self._outcomes = collections.deque(maxlen=self.WINDOW)
+        self._open_until = None
+        self._probing = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self._open_until = asyncio.get_event_loop().time() + self.cooldown
+        self._outcomes.clear()
+        self._probing = False
+
+    async def wait(self):
+        """Waits until a request to the host may be sent, returning True if
+        it is to be the probe request of a half-open breaker."""
+        while self.state != self.CLOSED:
+            now = asyncio.get_event_loop().time()
+            if self.state == self.OPEN:
+                if now < self._open_until:
+                    await asyncio.sleep(self._open_until - now)
+                    continue
+                self.state = self.HALF_OPEN
+            if not self._probing:
+                self._probing = True
+                return True
+            await asyncio.sleep(self.POLL_INTERVAL)
+        return False
+
+    def record(self, success, probe=False):
+        """Records the outcome of a request to the host."""
+        if probe:
+            if success:
+                self.state = self.CLOSED
+                self.cooldown = self.base_cooldown
+                self._probing = False
+            else:
+                self.cooldown = min(self.cooldown * 2, _MAX_BREAKER_COOLDOWN)
+                self._open()
+            return
+        if self.state != self.CLOSED:
+            return
+        self._outcomes.append(success)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.MIN_OUTCOMES and \
+                failures >= self.FAILURE_RATIO * len(self._outcomes):
+            self._open()
+
+    def record_aborted(self, probe=False):
+        """Records that a request was cancelled before completing."""
+        if probe:
+            self._probing = False
+
+
+_BREAKERS = {}
+
+def get_host_breaker(hostname):
+    """Returns the circuit breaker in charge of the given hostname."""
+    host = _host_key(hostname)
+    if host not in _BREAKERS:
+        _BREAKERS[host] = _CircuitBreaker(_get_cfg().get(
+            _CfgKey.BREAKER_COOLDOWN, DEFAULT_BREAKER_COOLDOWN))
+    return _BREAKERS[host]
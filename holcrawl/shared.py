@@ -3,8 +3,21 @@
 import os
 import re
 import json
+import time
 import warnings
+import asyncio
+import threading
+import collections
+import hashlib
 import functools
+import contextlib
+import http.client
+from urllib.error import HTTPError
+
+from tqdm import tqdm
+import morejson
+
+from holcrawl.engine import run_sync
 
 _HOMEDIR = os.path.expanduser("~")
 _DEF_CFG_FILE_NAME = '.holcrawl_cfg.json'
@@ -36,6 +49,26 @@ def print_cfg():
 
 class _CfgKey(object):
     DATADIR = 'data_dir'
+    HTTP_HEADERS = 'http_headers'
+    POOL_SIZE = 'pool_size'
+    HOST_POOL_SIZES = 'host_pool_sizes'
+    HOST_LIMITS = 'host_limits'
+    MAX_USER_REVIEW_PAGES = 'max_user_review_pages'
+    PAGE_CACHE = 'page_cache'
+    PAGE_CACHE_MAX_MB = 'page_cache_max_mb'
+    CONNECT_TIMEOUT = 'connect_timeout'
+    READ_TIMEOUT = 'read_timeout'
+    MOVIE_DEADLINE = 'movie_deadline'
+    MAX_RETRIES = 'max_retries'
+    RETRY_BASE_DELAY = 'retry_base_delay'
+    RETRY_MAX_DELAY = 'retry_max_delay'
+    BREAKER_COOLDOWN = 'breaker_cooldown'
+    HEDGING = 'hedging'
+    HEDGE_PERCENTILE = 'hedge_percentile'
+    METACRITIC_SLUG_PREDICTION = 'metacritic_slug_prediction'
+    FAILURE_TTLS = 'failure_ttls'
+    FRONTIER_PATH = 'frontier_path'
+    REFRESH_TTLS = 'refresh_ttls'
 
 
 def set_data_dir_path(dir_path):
@@ -89,6 +122,51 @@ def _get_dataset_dir_path():
     return os.path.join(_get_data_dir_path(), _DATASET_DIR_NAME)
 
 
+_PAGE_CACHE_DIR_NAME = 'page_cache'
+
+def _get_page_cache_dir_path():
+    return os.path.join(_get_data_dir_path(), _PAGE_CACHE_DIR_NAME)
+
+
+_RESOLUTION_DIR_NAME = 'resolutions'
+
+def _get_resolution_file_path(name):
+    return os.path.join(
+        _get_data_dir_path(), _RESOLUTION_DIR_NAME, '{}.jsonl'.format(name))
+
+
+_IMDB_INDEX_FILE_NAME = 'imdb_title_index.db'
+
+def _get_imdb_index_file_path():
+    return os.path.join(_get_data_dir_path(), _IMDB_INDEX_FILE_NAME)
+
+
+_FAILURES_DIR_NAME = 'failures'
+
+def _get_failures_file_path(source):
+    return os.path.join(
+        _get_data_dir_path(), _FAILURES_DIR_NAME, '{}.jsonl'.format(source))
+
+
+_JOURNALS_DIR_NAME = 'journals'
+
+def _get_journal_file_path(job_name):
+    return os.path.join(
+        _get_data_dir_path(), _JOURNALS_DIR_NAME, '{}.jsonl'.format(job_name))
+
+
+_FRONTIER_FILE_NAME = 'frontier.db'
+
+def _get_frontier_file_path():
+    return os.path.join(_get_data_dir_path(), _FRONTIER_FILE_NAME)
+
+
+_FETCH_TIMES_DIR_NAME = 'fetch_times'
+
+def _get_fetch_times_dir_path(source):
+    return os.path.join(_get_data_dir_path(), _FETCH_TIMES_DIR_NAME, source)
+
+
 # === utilities ===
 
 def clear_empty_profiles():
@@ -104,11 +182,191 @@ def clear_empty_profiles():
                 if sum(1 for line in json_file) < 1:
                     os.remove(file_path)
 
+class SubPagesError(Exception):
+    """Raised when some of the pages making up a movie profile could not be
+    crawled.
+
+    The props attribute holds the properties extracted from the rest of the
+    pages, while errors maps the name of each failed page to its exception."""
+
+    def __init__(self, props, errors):
+        self.props = props
+        self.errors = errors
+        super().__init__("Crawling failed for pages: {}".format(
+            ', '.join(sorted(errors))))
+
+
+async def _gather_subpages(getters, *args, on_done=None):
+    """Concurrently awaits the getter of each sub-page in the given ordered
+    mapping of sub-page names to coroutine functions, called with the given
+    arguments, and returns all properties they extracted. If any of them
+    fails, a SubPagesError holding the properties extracted by the rest is
+    raised.
+
+    If given, on_done is called with the name and properties of each
+    sub-page as soon as it is crawled, so that they outlive the failure or
+    cancellation of the rest."""
+    futures = collections.OrderedDict(
+        (asyncio.ensure_future(get_props(*args)), subpage)
+        for subpage, get_props in getters.items())
+    results = {}
+    errors = {}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                subpage = futures[future]
+                if future.exception() is not None:
+                    errors[subpage] = future.exception()
+                    continue
+                results[subpage] = future.result()
+                if on_done is not None:
+                    on_done(subpage, results[subpage])
+    finally:
+        for future in pending:
+            future.cancel()
+    props = {}
+    for subpage in getters:
+        props.update(results.get(subpage, {}))
+    if errors:
+        raise SubPagesError(props, errors)
+    return props
+
+
+def _mark_missing_subpages(profile, existing, key, subpages, done):
+    """Marks the given profile, about to be saved over the given existing one
+    (None if there is none), under the given key with those of the given
+    sub-pages it still misses once the given done sub-pages are crawled, or
+    clears the mark once it misses none. New profiles start out missing all
+    sub-pages, while existing ones without a mark miss none."""
+    if existing is None:
+        missing = set(subpages)
+    else:
+        missing = set(existing.get(key, []))
+    missing -= set(done)
+    profile.pop(key, None)
+    if missing:
+        profile[key] = [subpage for subpage in subpages if subpage in missing]
+    return profile
+
+
+def _load_profile(file_path):
+    """Returns the profile saved at the given path, or None if there is
+    none."""
+    if not os.path.isfile(file_path):
+        return None
+    with open(file_path, 'r') as json_file:
+        return morejson.load(json_file)
+
+
+def _is_partial(profile, key):
+    """Returns True if the given profile is marked under the given key as
+    missing some of its sub-pages."""
+    return bool(profile.get(key))
+
+
+def _missing_subpages(file_path, key, subpages):
+    """Returns those of the given sub-pages the profile at the given path is
+    marked under the given key as missing."""
+    profile = _load_profile(file_path)
+    return [subpage for subpage in subpages
+            if subpage in profile.get(key, [])]
+
+
+def _save_profile(file_path, props, key, subpages, done, **dump_kwargs):
+    """Saves the given properties, extracted from the given done sub-pages,
+    to the profile at the given path, on top of those already saved to it.
+    Sub-pages the profile still misses are marked under the given key, and
+    the profile is dumped with the given keyword arguments."""
+    existing = _load_profile(file_path)
+    profile = dict(existing or {}, **props)
+    _mark_missing_subpages(profile, existing, key, subpages, done)
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w+') as json_file:
+        morejson.dump(profile, json_file, **dump_kwargs)
+    os.replace(tmp_path, file_path)
+
+
+class MovieNotFoundError(LookupError):
+    """Raised when a movie can't be found on the crawled site."""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when crawling a movie takes longer than its time budget."""
+
+
+async def _with_deadline(coro, deadline):
+    """Awaits the given coroutine, cancelling it and raising a
+    DeadlineExceededError if it does not complete within deadline seconds.
+
+    Unlike asyncio.wait_for, timeouts raised from within the coroutine
+    itself are propagated as they are."""
+    task = asyncio.ensure_future(coro)
+    done, _ = await asyncio.wait([task], timeout=deadline)
+    if not done:
+        task.cancel()
+        await asyncio.wait([task])
+        raise DeadlineExceededError(
+            "Not done within {} seconds".format(deadline))
+    return task.result()
+
+
 class _result:
     SUCCESS = 'succeeded'
     FAILURE = 'failed'
+    TIMEOUT = 'timed out'
     EXIST = 'already exist'
-    ALL_TYPES = [SUCCESS, FAILURE, EXIST]
+    KNOWN_FAILURE = 'failed recently'
+    DONE_BEFORE = 'done before resuming'
+    ALL_TYPES = [SUCCESS, FAILURE, TIMEOUT, EXIST, KNOWN_FAILURE, DONE_BEFORE]
+
+
+_DEF_MOVIE_DEADLINE = 600
+
+def _get_movie_deadline():
+    """Returns the total number of seconds allowed for crawling all pages of
+    a single movie from a single source."""
+    return _get_cfg().get(_CfgKey.MOVIE_DEADLINE, _DEF_MOVIE_DEADLINE)
+
+
+# --- profile fetch times ---
+
+def _read_fetch_times(source, file_name):
+    """Returns the title, year and sub-page fetch times recorded for the
+    profile with the given file name, or None if none were recorded."""
+    file_path = os.path.join(_get_fetch_times_dir_path(source), file_name)
+    try:
+        with open(file_path, 'r') as times_file:
+            return json.load(times_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _record_fetch_times(source, file_name, title, year, subpages,
+                        fetched_at=None):
+    """Records that the given sub-pages of the profile with the given file
+    name were just fetched. Nothing is recorded in replay mode."""
+    # pages replayed from the cache were not fetched just now
+    if _REPLAY:
+        return
+    fetched_at = fetched_at or time.time()
+    times = _read_fetch_times(source, file_name) or {'fetched_at': {}}
+    times['title'] = title
+    times['year'] = year
+    for subpage in subpages:
+        times['fetched_at'][subpage] = fetched_at
+    dir_path = _get_fetch_times_dir_path(source)
+    os.makedirs(dir_path, exist_ok=True)
+    _write_json_atomically(os.path.join(dir_path, file_name), times)
+
+
+def _write_json_atomically(file_path, obj, **kwargs):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as json_file:
+        json.dump(obj, json_file, **kwargs)
+    os.replace(tmp_path, file_path)
 
 
 def _file_length(file_path):
@@ -123,6 +381,399 @@ def _titles_from_file(file_path):
         return [line.strip() for line in titles_file]
 
 
+# --- crawl journals ---
+
+_RESUME = False
+
+def set_resume(resume):
+    """Sets whether crawl jobs continue from where their journal shows they
+    stopped, rather than start over."""
+    global _RESUME  # pylint: disable=W0603
+    _RESUME = resume
+
+
+class _CrawlJournal(object):
+    """An append-only journal of the outcome of every title crawled from
+    every source within a single crawl job."""
+
+    def __init__(self, file_path, resume=False):
+        self.file_path = file_path
+        self._done = set()
+        if resume:
+            try:
+                with open(file_path, 'r') as journal_file:
+                    for line in journal_file:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:  # a line cut short by a crash
+                            continue
+                        self._done.add(self._key(
+                            entry['source'], entry['title'], entry['year']))
+            except FileNotFoundError:
+                pass
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self._file = open(file_path, 'a' if resume else 'w')
+
+    @staticmethod
+    def _key(source, title, year):
+        return source, title, None if year is None else int(year)
+
+    def done(self, source, title, year):
+        """Returns True if the journal holds an outcome for the given
+        title."""
+        return self._key(source, title, year) in self._done
+
+    def record(self, source, title, year, result):
+        """Appends the outcome of crawling the given title to the journal."""
+        self._done.add(self._key(source, title, year))
+        self._file.write(json.dumps({
+            'source': source, 'title': title, 'year': year,
+            'result': result, 'at': time.time()}) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+_JOURNAL = None
+
+@contextlib.contextmanager
+def _journaled(job_name):
+    """Journals the outcomes of all titles crawled within the context under
+    the given job name, continuing from the existing journal of the job if
+    resuming. Nested jobs are journaled as part of the outermost one."""
+    global _JOURNAL  # pylint: disable=W0603
+    if _JOURNAL is not None:
+        yield _JOURNAL
+        return
+    if _SHARD is not None:
+        # shards sharing a data directory each keep their own journal
+        job_name += '_shard{}of{}'.format(*_SHARD)
+    _JOURNAL = _CrawlJournal(_get_journal_file_path(job_name), _RESUME)
+    try:
+        yield _JOURNAL
+    finally:
+        _JOURNAL.close()
+        _JOURNAL = None
+
+
+def _file_job_name(kind, file_path):
+    abs_path = os.path.abspath(file_path)
+    digest = hashlib.sha1(abs_path.encode('utf-8')).hexdigest()[:8]
+    base_name = os.path.splitext(os.path.basename(abs_path))[0]
+    return '{}_{}_{}'.format(kind, base_name, digest)
+
+
+def _years_job_name(kind, years):
+    return '{}_{}'.format(kind, '_'.join(str(year) for year in years))
+
+
+# --- field selection ---
+
+_FIELDS = None
+
+def set_fields(fields):
+    """Restricts crawls to the sub-pages producing the given profile fields.
+    Pass None to crawl all sub-pages."""
+    global _FIELDS  # pylint: disable=W0603
+    _FIELDS = None if fields is None else list(fields)
+
+
+def _get_fields():
+    return _FIELDS
+
+
+def _subpages_for_fields(subpage_fields, fields=None, prefix=''):
+    """Returns the sub-pages, in the given ordered mapping of sub-pages to
+    the fields they produce, producing any of the given fields, defaulting
+    to those set with set_fields; all sub-pages are returned if no fields
+    were selected. Given fields are named without the given prefix of the
+    fields in the mapping, and a ValueError is raised for unknown ones."""
+    if fields is None:
+        if _FIELDS is None:
+            return list(subpage_fields)
+        fields = set(_FIELDS)
+    else:
+        known = set(field for subpage in subpage_fields
+                    for field in subpage_fields[subpage])
+        unknown = [field for field in fields if prefix + field not in known]
+        if unknown:
+            raise ValueError("Unknown profile fields: {}.".format(
+                ', '.join(unknown)))
+        fields = set(prefix + field for field in fields)
+    return [subpage for subpage in subpage_fields
+            if set(subpage_fields[subpage]) & fields]
+
+
+# --- sharding ---
+
+_SHARD = None
+
+def set_shard(index, count):
+    """Restricts crawls over files and years to the index-th of count
+    disjoint shards of their titles, with index going from 1 to count. Pass
+    None to crawl all titles."""
+    global _SHARD  # pylint: disable=W0603
+    if index is None:
+        _SHARD = None
+        return
+    if not 1 <= index <= count:
+        raise ValueError("Shard index must be between 1 and {}.".format(
+            count))
+    _SHARD = (index, count)
+
+
+def _title_shard(title, count):
+    # a stable hash, unlike hash(), which is salted per process
+    digest = hashlib.md5(_normalize_title(title).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+def _shard_titles(titles):
+    """Returns the titles falling in the current shard."""
+    if _SHARD is None:
+        return titles
+    index, count = _SHARD
+    return [title for title in titles if _title_shard(title, count) == index]
+
+
+async def _crawl_titles_async(crawl_by_title_async, titles, verbose, year,
+                              workers, movie_pbar, source):
+    results = {res_type : 0 for res_type in _result.ALL_TYPES}
+    semaphore = asyncio.Semaphore(max(1, workers))
+    journal = _JOURNAL
+
+    async def _crawl(title):
+        async with semaphore:
+            result = await crawl_by_title_async(
+                title, verbose, year, movie_pbar)
+        if journal is not None:
+            journal.record(source, title, year, result)
+        return result
+
+    to_crawl = []
+    for title in titles:
+        if journal is not None and journal.done(source, title, year):
+            results[_result.DONE_BEFORE] += 1
+            movie_pbar.update(1)
+        else:
+            to_crawl.append(title)
+
+    # tasks are created in order, so titles are crawled in file order
+    tasks = [asyncio.ensure_future(_crawl(title)) for title in to_crawl]
+    for next_done in asyncio.as_completed(tasks):
+        results[await next_done] += 1
+        movie_pbar.update(1)
+    return results
+
+
+def _crawl_titles(crawl_by_title_async, titles, verbose, year=None,
+                  workers=1, source=None):
+    """Runs the given crawl_by_title_async coroutine function over all given
+    titles, with up to workers titles crawled concurrently on the crawling
+    event loop, and returns a count of results by type.
+
+    Within a journaled job, outcomes are journaled under the given source
+    name, and titles the journal already holds an outcome for are skipped.
+    When sharding, only titles in the current shard are crawled."""
+    titles = _shard_titles(titles)
+    movie_pbar = tqdm(total=len(titles), miniters=1, maxinterval=0.0001,
+                      mininterval=0.00000000001)
+    results = run_sync(_crawl_titles_async(
+        crawl_by_title_async, titles, verbose, year, workers, movie_pbar,
+        source))
+    movie_pbar.close()
+    return results
+
+
+def _crawl_sources(crawlers, titles, verbose, year=None, workers=1):
+    """Runs the crawl_by_title_async coroutine function of each source in the
+    given ordered mapping of source names to them over all given titles, all
+    sources at once on the crawling event loop, and returns a mapping of each
+    source to a count of its results by type.
+
+    Each source crawls up to workers titles concurrently, within the rate
+    limits of its own hosts, so a slow source never holds back the rest.
+    Journaling and sharding work as with _crawl_titles."""
+    titles = _shard_titles(titles)
+    movie_pbar = tqdm(total=len(titles) * len(crawlers), miniters=1,
+                      maxinterval=0.0001, mininterval=0.00000000001)
+
+    async def _crawl_all():
+        results = await asyncio.gather(*[
+            _crawl_titles_async(crawl_by_title_async, titles, verbose, year,
+                                workers, movie_pbar, source)
+            for source, crawl_by_title_async in crawlers.items()])
+        return dict(zip(crawlers, results))
+
+    results = run_sync(_crawl_all())
+    movie_pbar.close()
+    return results
+
+
+def _normalize_title(title):
+    return ' '.join(title.lower().split())
+
+
+class _PersistentMap(object):
+    """A thread-safe map from (title, year) pairs to values, persisted as an
+    append-only JSON-lines file in which later lines override earlier ones."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._map = None
+
+    @staticmethod
+    def _key(title, year):
+        return _normalize_title(title), None if year is None else int(year)
+
+    def _load(self):
+        self._map = {}
+        try:
+            with open(self.file_path, 'r') as map_file:
+                for line in map_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # a line cut short by a crash
+                        continue
+                    self._map[self._key(
+                        entry['title'], entry['year'])] = entry['value']
+        except FileNotFoundError:
+            pass
+
+    def get(self, title, year=None):
+        """Returns the value stored for the given title and year, or None."""
+        with self._lock:
+            if self._map is None:
+                self._load()
+            return self._map.get(self._key(title, year))
+
+    def put(self, title, year, value):
+        """Stores a value for the given title and year."""
+        key = self._key(title, year)
+        with self._lock:
+            if self._map is None:
+                self._load()
+            if self._map.get(key) == value:
+                return
+            self._map[key] = value
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            with open(self.file_path, 'a') as map_file:
+                map_file.write(json.dumps(
+                    {'title': key[0], 'year': key[1], 'value': value}) + '\n')
+
+
+class _failure:
+    NOT_FOUND = 'not_found'
+    EXTRACTION_ERROR = 'extraction_error'
+    HTTP_ERROR = 'http_error'
+    TIMEOUT = 'timeout'
+    NETWORK_ERROR = 'network_error'
+    OTHER = 'other'
+
+
+# the number of hours to skip a title for after it failed for each reason
+_DEF_FAILURE_TTLS = {
+    _failure.NOT_FOUND: 30 * 24,
+    _failure.EXTRACTION_ERROR: 7 * 24,
+    _failure.HTTP_ERROR: 3 * 24,
+    _failure.TIMEOUT: 12,
+    _failure.NETWORK_ERROR: 6,
+    _failure.OTHER: 24,
+}
+
+def _get_failure_ttl(reason):
+    ttls = dict(_DEF_FAILURE_TTLS)
+    ttls.update(_get_cfg().get(_CfgKey.FAILURE_TTLS, {}))
+    return ttls.get(reason, ttls[_failure.OTHER]) * 60 * 60
+
+
+def _failure_reason(exc):
+    """Returns the reason a crawl failed with the given exception for."""
+    if isinstance(exc, SubPagesError):
+        # the title is worth retrying as soon as any of its pages is
+        reasons = [_failure_reason(error) for error in exc.errors.values()]
+        return min(reasons, key=_get_failure_ttl)
+    if isinstance(exc, MovieNotFoundError):
+        return _failure.NOT_FOUND
+    if isinstance(exc, HTTPError):
+        if exc.code in (404, 410):
+            return _failure.NOT_FOUND
+        return _failure.HTTP_ERROR
+    if isinstance(exc, (DeadlineExceededError, asyncio.TimeoutError)):
+        return _failure.TIMEOUT
+    if isinstance(exc, (OSError, http.client.HTTPException,
+                        asyncio.IncompleteReadError)):
+        return _failure.NETWORK_ERROR
+    if isinstance(exc, (LookupError, ValueError, AttributeError, TypeError)):
+        return _failure.EXTRACTION_ERROR
+    return _failure.OTHER
+
+
+_REPLAY = False
+
+def set_replay_mode(enabled):
+    """Turns replay mode on or off. In replay mode pages are read from the
+    page cache only, with no network access."""
+    global _REPLAY  # pylint: disable=W0603
+    _REPLAY = bool(enabled)
+
+
+def is_replay_mode():
+    """Returns True if replay mode is on."""
+    return _REPLAY
+
+
+_FORCE_RETRY = False
+
+def set_force_retry(force):
+    """Sets whether to crawl titles that failed recently rather than skip
+    them."""
+    global _FORCE_RETRY  # pylint: disable=W0603
+    _FORCE_RETRY = force
+
+
+class _FailureLog(object):
+    """A persistent record of the titles that recently failed to crawl from
+    a source, and why. Titles are skipped until the time-to-live configured
+    for the reason they failed for expires."""
+
+    def __init__(self, source):
+        self._map = _PersistentMap(_get_failures_file_path(source))
+
+    def record(self, title, year, exc):
+        """Records that crawling the given title failed with the given
+        exception, returning the reason for the failure. Nothing is recorded
+        in replay mode."""
+        # pages missing from the cache in replay mode say nothing of the title
+        if _REPLAY:
+            return None
+        reason = _failure_reason(exc)
+        self._map.put(title, year, {
+            'reason': reason, 'failed_at': time.time(),
+            'error': '{}: {}'.format(type(exc).__name__, exc)[:200]})
+        return reason
+
+    def clear(self, title, year):
+        """Forgets any failure recorded for the given title."""
+        if self._map.get(title, year) is not None:
+            self._map.put(title, year, None)
+
+    def recent_failure(self, title, year):
+        """Returns the reason the given title failed for if it should still
+        be skipped, or None otherwise."""
+        if _FORCE_RETRY:
+            return None
+        entry = self._map.get(title, year)
+        if entry is None:
+            return None
+        if time.time() - entry['failed_at'] > _get_failure_ttl(
+                entry['reason']):
+            return None
+        return entry['reason']
+
+
 def _parse_string(string):
     return string.lower().strip().replace(' ', '_')
 
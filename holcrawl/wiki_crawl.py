@@ -1,11 +1,9 @@
 """Generate movie title files from Wikipedia."""
 
-import urllib.request
 import re
 import warnings
 
-from bs4 import BeautifulSoup as bs
-
+from holcrawl.fetch import fetch_soup
 from holcrawl.shared import _get_wiki_list_file_path
 
 # good for pages from 2014 onwards
@@ -33,7 +31,7 @@ class _NewExtractor(object):
 
     @staticmethod
     def _extract_titles_from_wiki_page(wiki_url, verbose):
-        wiki_page = bs(urllib.request.urlopen(wiki_url), "html.parser")
+        wiki_page = fetch_soup(wiki_url, 'wiki_list')
         movies_tables = wiki_page.find_all('table', {'class': 'wikitable'})
         titles = []
         for table in movies_tables:
@@ -65,7 +63,7 @@ class _OldExtractor(object):
 
     @staticmethod
     def _extract_titles_from_wiki_page(wiki_url, verbose):
-        wiki_page = bs(urllib.request.urlopen(wiki_url), "html.parser")
+        wiki_page = fetch_soup(wiki_url, 'wiki_list')
         table = wiki_page.find_all('table', {'class': 'wikitable'})[0]
         rows = table.find_all('tr')
         titles = []
@@ -0,0 +1,83 @@
+"""The frontier sub-command of the holcrawl CLI."""
+
+import click
+
+import holcrawl
+
+from .shared_options import _shared_options, _crawl_options
+
+_FRONTIER_OPTIONS = [
+    click.option('--frontier', 'frontier_path', default=None, type=str,
+                 help="The path of the frontier database; defaults to the "
+                      "frontier_path configuration key, or to frontier.db "
+                      "in the data directory."),
+]
+
+def _frontier_options(func):
+    for option in reversed(_FRONTIER_OPTIONS):
+        func = option(func)
+    return func
+
+
+_SOURCE_OPTIONS = [
+    click.option('--source', 'sources', multiple=True,
+                 type=click.Choice(holcrawl.frontier.SOURCES),
+                 help="A source to crawl titles from; may be given more "
+                      "than once. Defaults to all sources."),
+]
+
+def _source_options(func):
+    for option in reversed(_SOURCE_OPTIONS):
+        func = option(func)
+    return func
+
+
+@click.group(help="Crawl a shared frontier of tasks from multiple nodes.")
+def frontier():
+    """Crawl a shared frontier of tasks from multiple nodes."""
+    pass
+
+
+@frontier.command(help="Add tasks for all titles in a text file.")
+@_shared_options
+@_frontier_options
+@_source_options
+@click.argument("file_path", type=str, nargs=1)
+@click.option('--year', default=None, type=int,
+              help="The year the movies came out in.")
+def byfile(file_path, verbose, frontier_path, sources, year):
+    """Add tasks for all titles in a text file."""
+    holcrawl.compound_cmd.enqueue_by_file(
+        file_path, verbose, year, sources, frontier_path)
+
+
+@frontier.command(help="Add tasks for all titles from given years.")
+@_shared_options
+@_frontier_options
+@_source_options
+@click.argument("years", type=int, nargs=-1)
+def byyears(years, verbose, frontier_path, sources):
+    """Add tasks for all titles from given years."""
+    holcrawl.compound_cmd.enqueue_by_years(
+        years, verbose, sources, frontier_path)
+
+
+@frontier.command(help="Crawl tasks from the frontier until none are left.")
+@_shared_options
+@_crawl_options
+@_frontier_options
+@click.option('--workers', default=1, type=int,
+              help="The number of tasks to crawl concurrently.")
+@click.option('--lease', default=holcrawl.frontier.DEFAULT_LEASE, type=int,
+              help="The number of seconds a claimed task is held for "
+                   "without a heartbeat.")
+def work(verbose, frontier_path, workers, lease):
+    """Crawl tasks from the frontier until none are left."""
+    holcrawl.frontier.work(verbose, workers, lease, frontier_path)
+
+
+@frontier.command(help="Print a count of the tasks in the frontier.")
+@_frontier_options
+def status(frontier_path):
+    """Print a count of the tasks in the frontier."""
+    holcrawl.frontier.print_frontier_stats(frontier_path)
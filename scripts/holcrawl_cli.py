@@ -8,7 +8,8 @@ from .imdb_cli import imdb
 from .meta_cli import meta
 from .wiki_cli import wiki
 from .dataset_cli import dataset
-from .shared_options import _shared_options
+from .frontier_cli import frontier
+from .shared_options import _shared_options, _crawl_options, _job_options
 
 
 @click.group()
@@ -23,8 +24,23 @@ def clear():
     holcrawl.shared.clear_empty_profiles()
 
 
+_PIPELINE_OPTIONS = [
+    click.option('--workers', default=1, type=int,
+                 help="The number of titles to crawl concurrently from "
+                      "each source."),
+    click.option('--pipelined/--sequential', default=True,
+                 help="Crawl all sources at once, or one after the other.")
+]
+
+def _pipeline_options(func):
+    for option in reversed(_PIPELINE_OPTIONS):
+        func = option(func)
+    return func
+
+
 @cli.command(help="Crawl all sources for a given title.")
 @_shared_options
+@_crawl_options
 @click.argument("title", type=str, nargs=1)
 def bytitle(title, verbose):
     """Crawl all sources for a given title."""
@@ -33,18 +49,44 @@ def bytitle(title, verbose):
 
 @cli.command(help="Crawl all sources for titles in a text file.")
 @_shared_options
+@_crawl_options
+@_job_options
+@_pipeline_options
 @click.argument("file_path", type=str, nargs=1)
-def byfile(file_path, verbose):
+def byfile(file_path, verbose, workers, pipelined):
     """Crawl all sources for titles in a text file."""
-    holcrawl.compound_cmd.crawl_all_by_file(file_path, verbose)
+    holcrawl.compound_cmd.crawl_all_by_file(
+        file_path, verbose, workers, pipelined)
 
 
 @cli.command(help="Crawl all sources for titles in the given years.")
 @_shared_options
+@_crawl_options
+@_job_options
+@_pipeline_options
 @click.argument("years", type=int, nargs=-1)
-def byyears(years, verbose):
+def byyears(years, verbose, workers, pipelined):
     """Crawl all sources for titles in the given years."""
-    holcrawl.compound_cmd.crawl_all_by_years(years, verbose)
+    holcrawl.compound_cmd.crawl_all_by_years(
+        years, verbose, workers, pipelined)
+
+
+@cli.command(help="Re-crawl the stale parts of existing profiles.")
+@_shared_options
+@_crawl_options
+@click.option('--source', 'sources', multiple=True,
+              type=click.Choice(holcrawl.refresh.SOURCES),
+              help="A source to refresh profiles of; may be given more "
+                   "than once. Defaults to all sources.")
+@click.option('--workers', default=1, type=int,
+              help="The number of profiles to refresh concurrently.")
+@click.option('--limit', default=None, type=int,
+              help="The maximal number of profiles to refresh.")
+@click.option('--dry-run', is_flag=True, default=False,
+              help="Only print the profiles due for a refresh.")
+def refresh(verbose, sources, workers, limit, dry_run):
+    """Re-crawl the stale parts of existing profiles."""
+    holcrawl.refresh.refresh(verbose, sources, workers, limit, dry_run)
 
 
 @cli.command(help="Sets a directory as the data directory.")
@@ -64,3 +106,4 @@ cli.add_command(imdb)
 cli.add_command(meta)
 cli.add_command(wiki)
 cli.add_command(dataset)
+cli.add_command(frontier)
@@ -4,7 +4,7 @@ import click
 
 import holcrawl
 
-from .shared_options import _shared_options
+from .shared_options import _shared_options, _crawl_options, _job_options
 
 
 @click.group(help="Crawl IMDB for movie profiles.")
@@ -15,6 +15,7 @@ def imdb():
 
 @imdb.command(help="Crawl IMDB for a specific title.")
 @_shared_options
+@_crawl_options
 @click.argument("title", type=str, nargs=1)
 @click.option('--year', default=None, type=int,
               help="The year the movie came out in.")
@@ -25,16 +26,22 @@ def bytitle(title, verbose, year):
 
 @imdb.command(help="Crawl IMDB for all titles in a text file.")
 @_shared_options
+@_crawl_options
+@_job_options
 @click.argument("file_path", type=str, nargs=1)
 @click.option('--year', default=None, type=int,
               help="The year the movie came out in.")
-def byfile(file_path, verbose, year):
+@click.option('--workers', default=1, type=int,
+              help="The number of titles to crawl concurrently.")
+def byfile(file_path, verbose, year, workers):
     """Crawl IMDB for all titles in a text file."""
-    holcrawl.imdb_crawl.crawl_by_file(file_path, verbose, year)
+    holcrawl.imdb_crawl.crawl_by_file(file_path, verbose, year, workers)
 
 
 @imdb.command(help="Crawl IMDB for all titles from a given year.")
 @_shared_options
+@_crawl_options
+@_job_options
 @click.argument("year", type=int, nargs=1)
 def byyear(year, verbose):
     """Crawl IMDB for all titles from a given year."""
@@ -43,6 +50,8 @@ def byyear(year, verbose):
 
 @imdb.command(help="Crawl IMDB for all titles from given years.")
 @_shared_options
+@_crawl_options
+@_job_options
 @click.argument("years", type=int, nargs=-1)
 def byyears(years, verbose):
     """Crawl IMDB for all titles from given years."""
@@ -54,3 +63,12 @@ def byyears(years, verbose):
 def unite(verbose):
     """Unite all profiles in the IMDB directory."""
     holcrawl.imdb_crawl.unite_imdb_profiles(verbose)
+
+
+@imdb.command(help="Build an offline index of IMDB movie codes from a "
+                   "title.basics.tsv.gz IMDb dataset file.")
+@_shared_options
+@click.argument("file_path", type=click.Path(exists=True), nargs=1)
+def buildindex(file_path, verbose):
+    """Build an offline index of IMDB movie codes."""
+    holcrawl.imdb_index.build_imdb_index(file_path, verbose)
@@ -4,7 +4,7 @@ import click
 
 import holcrawl
 
-from .shared_options import _shared_options
+from .shared_options import _shared_options, _crawl_options, _job_options
 
 
 @click.group(help="Crawl Metacritic for movie profiles.")
@@ -15,6 +15,7 @@ def meta():
 
 @meta.command(help="Crawl Metacritic for a specific title.")
 @_shared_options
+@_crawl_options
 @click.argument("title", type=str, nargs=1)
 @click.option('--year', default=None, type=int,
               help="The year the movie came out in.")
@@ -25,16 +26,22 @@ def bytitle(title, verbose, year):
 
 @meta.command(help="Crawl Metacritic for titles in a text file.")
 @_shared_options
+@_crawl_options
+@_job_options
 @click.argument("file_path", type=str, nargs=1)
 @click.option('--year', default=None, type=int,
               help="The year the movie came out in.")
-def byfile(file_path, verbose, year):
+@click.option('--workers', default=1, type=int,
+              help="The number of titles to crawl concurrently.")
+def byfile(file_path, verbose, year, workers):
     """Crawl Metacritic for titles in a text file."""
-    holcrawl.metacritic_crawl.crawl_by_file(file_path, verbose, year)
+    holcrawl.metacritic_crawl.crawl_by_file(file_path, verbose, year, workers)
 
 
 @meta.command(help="Crawl Metacritic for all titles from a year.")
 @_shared_options
+@_crawl_options
+@_job_options
 @click.argument("year", type=int, nargs=1)
 def byyear(year, verbose):
     """Crawl Metacritic for all titles from a year."""
@@ -2,6 +2,8 @@
 
 import click
 
+import holcrawl
+
 _SHARED_OPTIONS = [
     click.option('--verbose/--silent', default=True,
                  help="Turn printing progress to screen on or off.")
@@ -11,3 +13,83 @@ def _shared_options(func):
     for option in reversed(_SHARED_OPTIONS):
         func = option(func)
     return func
+
+
+def _set_replay_mode(ctx, param, value):  # pylint: disable=W0613
+    holcrawl.fetch.set_replay_mode(value)
+    return value
+
+
+def _set_force_retry(ctx, param, value):  # pylint: disable=W0613
+    holcrawl.shared.set_force_retry(value)
+    return value
+
+
+def _set_fields(ctx, param, value):  # pylint: disable=W0613
+    if value is None:
+        holcrawl.shared.set_fields(None)
+        return value
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    known = holcrawl.imdb_crawl.FIELDS + holcrawl.metacritic_crawl.FIELDS
+    unknown = [field for field in fields if field not in known]
+    if unknown:
+        raise click.BadParameter("unknown profile fields: {}.".format(
+            ', '.join(unknown)))
+    holcrawl.shared.set_fields(fields)
+    return value
+
+
+_CRAWL_OPTIONS = [
+    click.option('--replay', is_flag=True, default=False, expose_value=False,
+                 callback=_set_replay_mode,
+                 help="Read pages from the page cache only, rebuilding "
+                      "existing profiles."),
+    click.option('--force', is_flag=True, default=False, expose_value=False,
+                 callback=_set_force_retry,
+                 help="Crawl titles that failed recently rather than skip "
+                      "them."),
+    click.option('--fields', default=None, type=str, expose_value=False,
+                 callback=_set_fields, metavar='FIELD,...',
+                 help="Crawl only the pages producing the given "
+                      "comma-separated profile fields.")
+]
+
+def _crawl_options(func):
+    for option in reversed(_CRAWL_OPTIONS):
+        func = option(func)
+    return func
+
+
+def _set_resume(ctx, param, value):  # pylint: disable=W0613
+    holcrawl.shared.set_resume(value)
+    return value
+
+
+def _set_shard(ctx, param, value):  # pylint: disable=W0613
+    if value is None:
+        holcrawl.shared.set_shard(None, None)
+        return value
+    try:
+        index, count = (int(part) for part in value.split('/'))
+        holcrawl.shared.set_shard(index, count)
+    except ValueError:
+        raise click.BadParameter(
+            "must be of the form i/N, with i between 1 and N.")
+    return value
+
+
+_JOB_OPTIONS = [
+    click.option('--resume', is_flag=True, default=False, expose_value=False,
+                 callback=_set_resume,
+                 help="Continue the job from where its last run stopped, "
+                      "skipping titles it already crawled."),
+    click.option('--shard', default=None, type=str, expose_value=False,
+                 callback=_set_shard, metavar='i/N',
+                 help="Crawl only the i-th of N disjoint shards of the "
+                      "titles, for running N independent crawls.")
+]
+
+def _job_options(func):
+    for option in reversed(_JOB_OPTIONS):
+        func = option(func)
+    return func
@@ -0,0 +1,130 @@
+"""Tests for the crawl frontier of holcrawl.frontier."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from holcrawl import frontier
+from holcrawl.shared import _result
+
+
+class _FrontierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.dir_path, 'frontier.db')
+        self.frontier = frontier.Frontier(self.file_path, max_attempts=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_path)
+
+    def state(self, title, source='imdb'):
+        return self.frontier._db.execute(
+            "SELECT state, attempts, result FROM tasks WHERE title = ? AND "
+            "source = ?", (title, source)).fetchone()
+
+
+class TestLeases(_FrontierTestCase):
+
+    def test_enqueue_ignores_known_tasks(self):
+        tasks = [('Foo', 2016, 'imdb'), ('Foo', 2016, 'metacritic')]
+        self.assertEqual(self.frontier.enqueue(tasks), 2)
+        self.assertEqual(self.frontier.enqueue(tasks), 0)
+        self.assertEqual(self.frontier.unfinished(), 2)
+
+    def test_claimed_tasks_are_leased(self):
+        self.frontier.enqueue([('Foo', None, 'imdb')])
+        task, = self.frontier.claim('a')
+        self.assertEqual(task, frontier.Task('Foo', None, 'imdb', 1))
+        self.assertEqual(self.frontier.claim('b'), [])
+
+    def test_expired_lease_is_taken_over(self):
+        self.frontier.enqueue([('Foo', 2016, 'imdb')])
+        lost, = self.frontier.claim('a', lease=-1)
+        task, = self.frontier.claim('b')
+        self.assertEqual(task.attempts, 2)
+        # the first owner can no longer release the task
+        self.assertIsNone(
+            self.frontier.release('a', lost, _result.SUCCESS))
+        self.assertEqual(
+            self.frontier.release('b', task, _result.SUCCESS),
+            frontier._state.DONE)
+
+    def test_heartbeat_extends_leases(self):
+        self.frontier.enqueue([('Foo', 2016, 'imdb')])
+        self.frontier.claim('a', lease=-1)
+        self.frontier.heartbeat('a')
+        self.assertEqual(self.frontier.claim('b'), [])
+
+
+class TestRelease(_FrontierTestCase):
+
+    def test_failed_tasks_are_retried_up_to_max_attempts(self):
+        self.frontier.enqueue([('Foo', 2016, 'imdb')])
+        for attempt in range(1, 4):
+            task, = self.frontier.claim('a')
+            self.assertEqual(task.attempts, attempt)
+            state = self.frontier.release('a', task, _result.FAILURE)
+        self.assertEqual(state, frontier._state.FAILED)
+        self.assertEqual(self.state('Foo'), ('failed', 3, 'failed'))
+        self.assertEqual(self.frontier.unfinished(), 0)
+
+    def test_retried_task_may_succeed(self):
+        self.frontier.enqueue([('Foo', 2016, 'imdb')])
+        task, = self.frontier.claim('a')
+        self.assertEqual(self.frontier.release('a', task, _result.TIMEOUT),
+                         frontier._state.PENDING)
+        task, = self.frontier.claim('a')
+        self.frontier.release('a', task, _result.SUCCESS)
+        self.assertEqual(self.state('Foo'), ('done', 2, 'succeeded'))
+
+    def test_known_failures_are_not_done(self):
+        self.frontier.enqueue([('Foo', 2016, 'imdb')])
+        task, = self.frontier.claim('a')
+        self.frontier.release('a', task, _result.KNOWN_FAILURE)
+        self.assertEqual(self.state('Foo')[0], 'failed')
+        self.assertEqual(
+            self.frontier.stats()['imdb'][frontier._state.DONE], 0)
+
+
+class TestWork(_FrontierTestCase):
+
+    def test_retries_bypass_the_failure_log(self):
+        self.frontier.enqueue([('Foo', 2016, 'imdb')])
+        calls = []
+
+        async def _crawl(title, verbose, year=None, parent_pbar=None,
+                         force=False):
+            calls.append(force)
+            # mimics a failure log holding the first, failed, attempt
+            if len(calls) == 1:
+                return _result.FAILURE
+            if not force:
+                return _result.KNOWN_FAILURE
+            return _result.SUCCESS
+
+        with mock.patch.dict(frontier._CRAWLERS, {'imdb': _crawl}), \
+                mock.patch('builtins.print') as printed:
+            frontier.work(False, frontier_path=self.file_path)
+        self.assertEqual(calls, [False, True])
+        self.assertEqual(self.state('Foo'), ('done', 2, 'succeeded'))
+        printed.assert_any_call("1 tasks crawled.")
+
+    def test_failing_task_is_given_up_on(self):
+        self.frontier.enqueue([('Foo', 2016, 'imdb')])
+
+        async def _crawl(title, verbose, year=None, parent_pbar=None,
+                         force=False):
+            raise ConnectionResetError()
+
+        with mock.patch.dict(frontier._CRAWLERS, {'imdb': _crawl}), \
+                mock.patch('builtins.print') as printed:
+            frontier.work(False, frontier_path=self.file_path)
+        self.assertEqual(self.state('Foo'), ('failed', 3, 'failed'))
+        printed.assert_any_call("1 tasks crawled.")
+
+
+if __name__ == '__main__':
+    unittest.main()